@@ -1,24 +1,44 @@
+import fcntl
 import json
 import os
 import re
 import secrets
+import shutil
 import subprocess
 import threading
-from datetime import datetime
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta
 from functools import wraps
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+import click
+from markupsafe import Markup, escape
 from werkzeug.utils import secure_filename
 
-from flask import (Flask, Response, abort, flash, jsonify, redirect,
-                   render_template, request, session, url_for)
+from flask import (Flask, Response, abort, flash, g, has_request_context, jsonify, redirect,
+                   render_template, request, send_file, send_from_directory, session, url_for)
+
+import backup
+import batch
+import builds
+import fragment_cache
+import image_meta
+import journal
+import listing
+import profiler
+import tenants
+import upload_store
+from deploy import DeployQueue
+from article_prep import PREP_VERSION, excerpt_from_text, prepare_article
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", secrets.token_hex(32))
+# {% cache %} tag for the shared page chrome (see fragment_cache.py)
+app.jinja_env.add_extension(fragment_cache.FragmentCacheExtension)
 
-UPLOAD_FOLDER = os.path.join(app.static_folder, "uploads")
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp", "svg"}
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16 MB
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
 def allowed_file(filename):
@@ -34,7 +54,8 @@ def save_upload(file_storage, subfolder=""):
     fname = secure_filename(file_storage.filename)
     # Ensure unique name
     base, ext = os.path.splitext(fname)
-    dest_dir = os.path.join(UPLOAD_FOLDER, subfolder) if subfolder else UPLOAD_FOLDER
+    t = current_tenant()
+    dest_dir = os.path.join(t.upload_folder, subfolder) if subfolder else t.upload_folder
     os.makedirs(dest_dir, exist_ok=True)
     dest = os.path.join(dest_dir, fname)
     counter = 1
@@ -43,57 +64,415 @@ def save_upload(file_storage, subfolder=""):
         dest = os.path.join(dest_dir, fname)
         counter += 1
     file_storage.save(dest)
-    rel = os.path.relpath(dest, app.static_folder).replace(os.sep, "/")
+    rel = os.path.relpath(dest, t.static_dir).replace(os.sep, "/")
+    image_meta.update(t.images_file, t.static_dir, [rel], force=True)
+    upload_store.add(t.store_dir, dest)  # stored right away, the manifest follows on deploy
     return rel
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
-CONTENT_FILE = os.path.join(DATA_DIR, "content.json")
-ARTICLES_FILE = os.path.join(DATA_DIR, "articles.json")
-ANNOUNCEMENTS_FILE = os.path.join(DATA_DIR, "announcements.json")
 
-ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "admin")
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(APP_DIR, "data")             # app-wide state (scheduler lock)
+
+# Tenants: one site from this directory, or several listed in TENANTS_FILE (see tenants.py)
+tenants.load(APP_DIR, os.environ.get("TENANTS_FILE"), os.environ.get("ADMIN_PASSWORD", "admin"))
+
+
+def find_tenant():
+    """Site being served: explicitly activated, chosen by Host, or the only one."""
+    tenant = tenants.active()
+    if tenant is None and has_request_context():
+        if "tenant" not in g:
+            g.tenant = tenants.for_host(request.host)
+        tenant = g.tenant
+    if tenant is None:
+        # Fixed by the build (freeze.py --tenant) or by TENANT for CLI commands
+        key = app.config.get("TENANT") or ("" if has_request_context() else os.environ.get("TENANT", ""))
+        tenant = tenants.get(key) or tenants.single()
+    return tenant
+
+
+def current_tenant():
+    return find_tenant() or abort(404)
+
+
+app.jinja_env.fragment_cache_scope = lambda: current_tenant().key
+
+
+@app.before_request
+def resolve_tenant():
+    # Unknown hosts are refused before any view runs; there is no site to render a 404 page for
+    if find_tenant() is None:
+        return "Not Found", 404
+
+
+@app.before_request
+def hold_edits_lock():
+    # Changes made by one request land in the same build snapshot (see snapshot_data)
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        g.edits_lock = ExitStack()
+        g.edits_lock.enter_context(journal.locked(current_tenant().edits_lock, shared=True))
+
+
+@app.teardown_request
+def release_edits_lock(exc):
+    lock = g.pop("edits_lock", None)
+    if lock is not None:
+        lock.close()
+
+
+def static_with_uploads(filename):
+    """Static files come from the app, uploads from the current site."""
+    if filename.startswith("uploads/"):
+        return send_from_directory(current_tenant().static_dir, filename)
+    return app.send_static_file(filename)
+
+
+app.view_functions["static"] = static_with_uploads
+
+# Scheduled publishing: times entered in the admin are in the site's timezone
+SITE_TIMEZONE = os.environ.get("SITE_TIMEZONE", "Europe/Moscow")
+app.config["SCHEDULER_ENABLED"] = os.environ.get("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_INTERVAL = 30        # seconds between checks
+SCHEDULER_BATCH_WINDOW = 120   # collect everything due within this window into one deploy
 
 
 # ─── Data helpers ───────────────────────────────────────────────
 
 def load_json(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return journal.load(path)
+
+
+def save_json(path, data, note=None):
+    """Record a save as a compact journal entry (see journal.py)."""
+    rev = journal.save(path, data, note=note)
+    app.jinja_env.fragment_cache.clear(current_tenant().key)
+    return rev
+
+
+# Sections shown on (and edited with) the home page
+INDEX_SECTIONS = ("hero", "help_section", "about_preview", "services_preview", "process_steps", "cta")
 
 
-def save_json(path, data):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+def section_file(name):
+    return os.path.join(current_tenant().content_dir, f"{name}.json")
 
 
-def get_content():
-    return load_json(CONTENT_FILE)
+def content_sections():
+    """Names of the content sections (site, hero, about_page, ...)."""
+    return sorted(f[:-5] for f in os.listdir(current_tenant().content_dir) if f.endswith(".json"))
+
+
+def get_section(name, default=None):
+    """Editable copy of one content section."""
+    path = section_file(name)
+    if not os.path.exists(path):
+        return default
+    return load_json(path)
+
+
+def get_sections(*names):
+    """Read-only view of the given sections, each loaded and cached separately; {} if missing."""
+    paths = {name: section_file(name) for name in names}
+    return {name: journal.view(path) if os.path.exists(path) else {} for name, path in paths.items()}
+
+
+def save_section(name, data, note=None):
+    return save_json(section_file(name), data, note=note)
+
+
+def data_files():
+    """All journaled data files."""
+    t = current_tenant()
+    bodies = sorted(os.path.join(t.articles_dir, name) for name in os.listdir(t.articles_dir)
+                    if name.endswith(".json")) if os.path.isdir(t.articles_dir) else []
+    return [section_file(n) for n in content_sections()] + [t.articles_file, t.announcements_file] + bodies
+
+
+def snapshot_data(dest):
+    """Consistent copy of the site's data files under ``dest``, for a build.
+
+    Waits for edits in progress (they hold ``edits_lock`` shared), so the
+    copy never has one file from before an edit and another from after it.
+    Edits wait only while the files are linked, not for the whole build.
+    """
+    t = current_tenant()
+    with journal.locked(t.edits_lock):
+        for path in data_files() + [t.images_file, t.uploads_file]:
+            journal.snapshot(path, os.path.join(dest, os.path.relpath(path, t.root)))
+    return t.at(dest)
+
+
+def split_content(tenant):
+    """One-time migration: split legacy content.json into per-section files."""
+    legacy = tenant.content_file
+    if not os.path.exists(legacy):
+        return
+    with journal.locked(legacy):
+        if not os.path.exists(legacy):
+            return  # another worker got here first
+        content = journal.load(legacy)
+        for name, section in content.items():
+            journal.write_snapshot(os.path.join(tenant.content_dir, f"{name}.json"), section)
+        for suffix in ("", ".journal", ".history"):
+            if os.path.exists(legacy + suffix):
+                os.remove(legacy + suffix)
+
+
+for _tenant in tenants.all_tenants():
+    os.makedirs(_tenant.upload_folder, exist_ok=True)
+    os.makedirs(_tenant.articles_dir, exist_ok=True)
+    split_content(_tenant)
 
 
 def get_articles():
-    return load_json(ARTICLES_FILE)
+    return load_json(current_tenant().articles_file)
 
 
 def get_announcements():
-    return load_json(ANNOUNCEMENTS_FILE)
+    return load_json(current_tenant().announcements_file)
+
+
+def save_articles(artcls, note=None):
+    return save_json(current_tenant().articles_file, artcls, note=note)
+
+
+def save_announcements(anns, note=None):
+    return save_json(current_tenant().announcements_file, anns, note=note)
+
+
+# ─── Scheduled publishing ──────────────────────────────────────
+
+def site_now():
+    """Current naive datetime in the site's timezone."""
+    try:
+        return datetime.now(ZoneInfo(SITE_TIMEZONE)).replace(tzinfo=None)
+    except ZoneInfoNotFoundError:
+        return datetime.now()
+
+
+def parse_dt(value):
+    """Parse a datetime-local / ISO string, returning None if empty or invalid."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def expires_at(ann):
+    """Announcements expire once their day is over."""
+    try:
+        day = datetime.strptime(ann.get("date", ""), "%Y-%m-%d")
+    except ValueError:
+        return None
+    return day + timedelta(days=1)
+
+
+def is_live(item, now=None):
+    """Whether an article or announcement is publicly visible right now."""
+    now = now or site_now()
+    publish_at = parse_dt(item.get("publish_at"))
+    unpublish_at = parse_dt(item.get("unpublish_at"))
+    if publish_at and publish_at > now:
+        return False
+    if unpublish_at and unpublish_at <= now:
+        return False
+    return bool(item.get("published") or publish_at)
+
+
+def is_live_announcement(ann, now=None):
+    now = now or site_now()
+    expiry = expires_at(ann)
+    return is_live(ann, now) and not (expiry and expiry <= now)
+
+
+def schedule_status(item, now=None, expiring=False):
+    """Short status for admin lists: published, scheduled, expired or draft.
+
+    Expired: the unpublish time (or, with ``expiring``, the announcement's
+    day) has passed, so the item stays off the site until that is changed.
+    """
+    now = now or site_now()
+    unpublish_at = parse_dt(item.get("unpublish_at"))
+    expiry = expires_at(item) if expiring else None
+    if any(t and t <= now for t in (unpublish_at, expiry)):
+        return "expired"
+    publish_at = parse_dt(item.get("publish_at"))
+    if publish_at and publish_at > now:
+        return "scheduled"
+    return "published" if is_live(item, now) else "draft"
+
+
+# ─── Admin list indexes ────────────────────────────────────────
+
+LIST_SORTS = {
+    "articles": {"title": lambda a: a.get("title", "").casefold()},
+    "announcements": {"title": lambda a: a.get("title", "").casefold(),
+                      "date": lambda a: (a.get("date", ""), a.get("time", ""))},
+}
+
+
+def drop_past_unpublish(item, now=None):
+    """A published item with an unpublish time already gone would stay expired; drop that time."""
+    unpublish_at = parse_dt(item.get("unpublish_at"))
+    if item.get("published") and unpublish_at and unpublish_at <= (now or site_now()):
+        item["unpublish_at"] = ""
+    return item
+
+
+def next_status_change(items, now, expiring=False):
+    """Earliest future publish/unpublish (or expiry) time among ``items``, or None."""
+    times = [parse_dt(item.get(key)) for item in items for key in ("publish_at", "unpublish_at")]
+    if expiring:
+        times += [expires_at(item) for item in items]
+    return min((t for t in times if t and t > now), default=None)
+
+
+def list_index(kind):
+    """Index of the articles or announcements list (see listing.py)."""
+    t = current_tenant()
+    path = t.articles_file if kind == "articles" else t.announcements_file
+    now = site_now()
+    expiring = kind == "announcements"
+
+    def build(items):
+        return listing.Index(items, lambda item: schedule_status(item, now, expiring), LIST_SORTS[kind],
+                             next_status_change(items, now, expiring))
+    return listing.index_for(path, journal.view(path), build, now)
+
+
+def list_page(kind):
+    """One page of an admin list, as requested by the query string."""
+    args = request.args
+    return list_index(kind).query(
+        q=args.get("q", ""),
+        status=args.get("status", ""),
+        sort=args.get("sort", "position"),
+        desc=args.get("dir") == "desc",
+        page=args.get("page", 1, type=int),
+    )
 
 
 # ─── Template context ──────────────────────────────────────────
 
 @app.context_processor
 def inject_globals():
-    content = get_content()
-    site = content["site"]
-    return {"site": site}
+    return get_sections("site")
+
+
+def data_version(name):
+    """Version of a content section, for fragment cache keys."""
+    return journal.version(section_file(name))
+
+
+app.add_template_filter(excerpt_from_text, "excerpt")
+app.add_template_global(data_version)
+app.add_template_global(schedule_status)
+
+
+# ─── Image metadata ────────────────────────────────────────────
+
+def referenced_images():
+    """Paths (relative to static/) of every image the data files point to."""
+    pages = get_sections("hero", "about_preview", "about_page", "documents_page")
+    paths = [pages["hero"].get("image"), pages["about_preview"].get("image"),
+             pages["about_page"].get("image")]
+    paths += [d.get("image") for d in pages["documents_page"].get("docs", [])]
+    paths += [a.get("image") for a in get_articles()]
+    paths += [a.get("image") for a in get_announcements()]
+    return [p for p in paths if p and p.startswith("uploads/")]
+
+
+@app.template_global()
+def img_attrs(path, style=""):
+    """width/height and a placeholder background for an <img> of an uploaded file."""
+    info = image_meta.load(current_tenant().images_file).get(path)
+    if not info:
+        return Markup(f' style="{escape(style)}"') if style else Markup("")
+    background = f"background: {info['color']} url('{info['placeholder']}') center / cover no-repeat;"
+    return Markup(f' width="{info["width"]}" height="{info["height"]}"'
+                  f' style="{escape(background + " " + style)}"')
+
+
+UPLOAD_LINK_RE = re.compile(r"""static/(uploads/[^"'?#\s)]+)""")
+
+
+def referenced_uploads():
+    """Every upload the site needs: image fields plus files linked from article texts."""
+    paths = set(referenced_images())
+    for art in get_articles():
+        paths.update(UPLOAD_LINK_RE.findall(get_article_body(art).get("content") or ""))
+    return sorted(paths)
+
+
+def _linked_files(value, key=None):
+    """Uploads and article body files a piece of data refers to (absolute paths)."""
+    t = current_tenant()
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _linked_files(v, k)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _linked_files(v)
+    elif isinstance(value, str):
+        if key == "image" and value.startswith("uploads/"):
+            yield os.path.join(t.static_dir, value)
+        elif key == "body":
+            yield os.path.join(t.articles_dir, f"{value}.json")
+        else:
+            for rel in UPLOAD_LINK_RE.findall(value):
+                yield os.path.join(t.static_dir, rel)
+
+
+def missing_files(state):
+    """Files ``state`` refers to that are gone, relative to the site root (for history reverts)."""
+    root = current_tenant().root
+    return sorted({os.path.relpath(p, root) for p in _linked_files(state) if not os.path.exists(p)})
+
+
+def sync_uploads():
+    """Store the referenced uploads and rewrite data/uploads.json; returns the paths not found."""
+    t = current_tenant()
+    _, missing = upload_store.sync(t.store_dir, t.static_dir, t.uploads_file, referenced_uploads())
+    return missing
+
+
+@app.cli.command("image-meta")
+@click.option("--force", is_flag=True, help="Recompute entries that already exist.")
+def image_meta_command(force):
+    """Backfill sizes and placeholders for all referenced uploaded images."""
+    for t in tenants.all_tenants():
+        with tenants.activate(t):
+            paths = referenced_images()
+            done = image_meta.update(t.images_file, t.static_dir, paths, force=force, prune=True)
+            print(f"[{t.key}] Обработано изображений: {done} (всего используется: {len(paths)})")
+
+
+@app.cli.command("uploads-sync")
+def uploads_sync_command():
+    """Put referenced uploads into the object store and refresh data/uploads.json."""
+    for t in tenants.all_tenants():
+        with tenants.activate(t):
+            missing = sync_uploads()
+            total = len(upload_store.load_manifest(t.uploads_file) or {})
+            print(f"[{t.key}] В хранилище: {total} файлов" + (f", не найдены: {', '.join(missing)}" if missing else ""))
+
+
+@app.cli.command("uploads-restore")
+def uploads_restore_command():
+    """Recreate missing files in static/uploads/ from the object store."""
+    for t in tenants.all_tenants():
+        manifest = upload_store.load_manifest(t.uploads_file) or {}
+        missing = upload_store.restore(t.store_dir, manifest, t.static_dir)
+        print(f"[{t.key}] Файлов в манифесте: {len(manifest)}" + (f", нет в хранилище: {', '.join(missing)}" if missing else ""))
 
 
 # ─── SEO routes ─────────────────────────────────────────────────
 
 @app.route("/robots.txt")
 def robots_txt():
-    content = get_content()
-    site_url = content["site"].get("site_url", "")
+    site_url = get_sections("site")["site"].get("site_url", "")
     body = (
         "User-agent: *\n"
         "Allow: /\n"
@@ -105,8 +484,7 @@ def robots_txt():
 
 @app.route("/sitemap.xml")
 def sitemap_xml():
-    content = get_content()
-    site_url = content["site"].get("site_url", "")
+    site_url = get_sections("site")["site"].get("site_url", "")
     pages = [
         {"loc": "/", "priority": "1.0", "changefreq": "weekly"},
         {"loc": "/about/", "priority": "0.8", "changefreq": "monthly"},
@@ -117,7 +495,7 @@ def sitemap_xml():
         {"loc": "/documents/", "priority": "0.5", "changefreq": "monthly"},
     ]
     for art in get_articles():
-        if art.get("published"):
+        if is_live(art):
             pages.append(
                 {"loc": f"/articles/{art['slug']}/", "priority": "0.6", "changefreq": "monthly"}
             )
@@ -137,58 +515,59 @@ def sitemap_xml():
 
 @app.route("/")
 def index():
-    data = get_content()
+    data = get_sections(*INDEX_SECTIONS)
     return render_template("index.html", data=data)
 
 
 @app.route("/about/")
 def about():
-    data = get_content()
+    data = get_sections("about_page", "documents_page")
     return render_template("about.html", data=data)
 
 
 @app.route("/documents/")
 def documents():
-    data = get_content()
+    data = get_sections("documents_page")
     return render_template("documents.html", data=data)
 
 
 @app.route("/services/")
 def services():
-    data = get_content()
+    data = get_sections("services_page")
     return render_template("services.html", data=data)
 
 
 @app.route("/contact/")
 def contact():
-    data = get_content()
+    data = get_sections("contact_page")
     return render_template("contact.html", data=data)
 
 
 @app.route("/announcements/")
 def announcements():
     all_announcements = get_announcements()
-    data = get_content()
-    published = [a for a in all_announcements if a.get("published", False)]
-    return render_template("announcements.html", announcements=published, data=data)
+    now = site_now()
+    published = [a for a in all_announcements if is_live_announcement(a, now)]
+    return render_template("announcements.html", announcements=published)
 
 
 @app.route("/articles/")
 def articles():
     all_articles = get_articles()
-    data = get_content()
-    published = [a for a in all_articles if a.get("published", False)]
+    data = get_sections("articles_cta")
+    now = site_now()
+    published = [a for a in all_articles if is_live(a, now)]
     return render_template("articles.html", articles=published, data=data)
 
 
 @app.route("/articles/<slug>/")
 def article(slug):
     all_articles = get_articles()
-    data = get_content()
-    art = next((a for a in all_articles if a["slug"] == slug and a.get("published", False)), None)
+    data = get_sections("articles_cta")
+    art = next((a for a in all_articles if a["slug"] == slug and is_live(a)), None)
     if art is None:
         abort(404)
-    return render_template("article.html", article=art, data=data)
+    return render_template("article.html", article=art, prep=prepared(get_article_body(art)), data=data)
 
 
 # ─── Admin auth ─────────────────────────────────────────────────
@@ -196,7 +575,7 @@ def article(slug):
 def login_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        if not session.get("admin_logged_in"):
+        if session.get("admin_tenant") != current_tenant().key:
             return redirect(url_for("admin_login"))
         return f(*args, **kwargs)
     return decorated
@@ -205,8 +584,9 @@ def login_required(f):
 @app.route("/admin/login", methods=["GET", "POST"])
 def admin_login():
     if request.method == "POST":
-        if request.form.get("password") == ADMIN_PASSWORD:
-            session["admin_logged_in"] = True
+        t = current_tenant()
+        if secrets.compare_digest(request.form.get("password", ""), t.admin_password):
+            session["admin_tenant"] = t.key
             return redirect(url_for("admin_dashboard"))
         flash("Неверный пароль", "error")
     return render_template("admin/login.html")
@@ -214,7 +594,7 @@ def admin_login():
 
 @app.route("/admin/logout")
 def admin_logout():
-    session.pop("admin_logged_in", None)
+    session.pop("admin_tenant", None)
     return redirect(url_for("index"))
 
 
@@ -223,10 +603,10 @@ def admin_logout():
 @app.route("/admin/")
 @login_required
 def admin_dashboard():
-    content = get_content()
-    artcls = get_articles()
-    anns = get_announcements()
-    return render_template("admin/dashboard.html", content=content, articles=artcls, announcements=anns)
+    services = get_sections("services_page")["services_page"].get("services", [])
+    return render_template("admin/dashboard.html", services_count=len(services),
+                           articles=list_index("articles").counts(),
+                           announcements=list_index("announcements").counts())
 
 
 # ─── Admin: Общие настройки ────────────────────────────────────
@@ -234,7 +614,7 @@ def admin_dashboard():
 @app.route("/admin/site", methods=["GET", "POST"])
 @login_required
 def admin_site():
-    content = get_content()
+    content = {"site": get_section("site")}
     if request.method == "POST":
         s = content["site"]
         s["name"] = request.form.get("name", s["name"])
@@ -245,7 +625,7 @@ def admin_site():
         s["vk_link"] = request.form.get("vk_link", s.get("vk_link", ""))
         s["address"] = request.form.get("address", s.get("address", ""))
         s["copyright_year"] = request.form.get("copyright_year", s.get("copyright_year", ""))
-        save_json(CONTENT_FILE, content)
+        save_section("site", s)
         flash("Настройки сайта сохранены", "success")
         return redirect(url_for("admin_site"))
     return render_template("admin/edit_site.html", content=content)
@@ -256,7 +636,7 @@ def admin_site():
 @app.route("/admin/index", methods=["GET", "POST"])
 @login_required
 def admin_index():
-    content = get_content()
+    content = {name: get_section(name) for name in INDEX_SECTIONS}
     if request.method == "POST":
         # Hero image upload
         hero_file = request.files.get("hero_image_file")
@@ -265,14 +645,14 @@ def admin_index():
             if new_path:
                 old = content["hero"].get("image", "")
                 if old and old.startswith("uploads/"):
-                    old_abs = os.path.join(app.static_folder, old)
+                    old_abs = os.path.join(current_tenant().static_dir, old)
                     if os.path.exists(old_abs):
                         os.remove(old_abs)
                 content["hero"]["image"] = new_path
         if request.form.get("hero_remove_image") == "1":
             old = content["hero"].get("image", "")
             if old and old.startswith("uploads/"):
-                old_abs = os.path.join(app.static_folder, old)
+                old_abs = os.path.join(current_tenant().static_dir, old)
                 if os.path.exists(old_abs):
                     os.remove(old_abs)
             content["hero"]["image"] = ""
@@ -300,14 +680,14 @@ def admin_index():
             if new_path:
                 old = content["about_preview"].get("image", "")
                 if old and old.startswith("uploads/"):
-                    old_abs = os.path.join(app.static_folder, old)
+                    old_abs = os.path.join(current_tenant().static_dir, old)
                     if os.path.exists(old_abs):
                         os.remove(old_abs)
                 content["about_preview"]["image"] = new_path
         if request.form.get("about_preview_remove_image") == "1":
             old = content["about_preview"].get("image", "")
             if old and old.startswith("uploads/"):
-                old_abs = os.path.join(app.static_folder, old)
+                old_abs = os.path.join(current_tenant().static_dir, old)
                 if os.path.exists(old_abs):
                     os.remove(old_abs)
             content["about_preview"]["image"] = ""
@@ -361,7 +741,8 @@ def admin_index():
         cta["text"] = request.form.get("cta_text", cta["text"])
         cta["button_text"] = request.form.get("cta_button_text", cta["button_text"])
 
-        save_json(CONTENT_FILE, content)
+        for name, section in content.items():
+            save_section(name, section)
         flash("Главная страница сохранена", "success")
         return redirect(url_for("admin_index"))
     return render_template("admin/edit_index.html", content=content)
@@ -372,7 +753,7 @@ def admin_index():
 @app.route("/admin/about", methods=["GET", "POST"])
 @login_required
 def admin_about():
-    content = get_content()
+    content = {"about_page": get_section("about_page")}
     if request.method == "POST":
         ap = content["about_page"]
 
@@ -383,14 +764,14 @@ def admin_about():
             if new_path:
                 old = ap.get("image", "")
                 if old and old.startswith("uploads/"):
-                    old_abs = os.path.join(app.static_folder, old)
+                    old_abs = os.path.join(current_tenant().static_dir, old)
                     if os.path.exists(old_abs):
                         os.remove(old_abs)
                 ap["image"] = new_path
         if request.form.get("about_remove_image") == "1":
             old = ap.get("image", "")
             if old and old.startswith("uploads/"):
-                old_abs = os.path.join(app.static_folder, old)
+                old_abs = os.path.join(current_tenant().static_dir, old)
                 if os.path.exists(old_abs):
                     os.remove(old_abs)
             ap["image"] = ""
@@ -456,7 +837,7 @@ def admin_about():
         cta["text"] = request.form.get("cta_text", cta["text"])
         cta["button_text"] = request.form.get("cta_button_text", cta["button_text"])
 
-        save_json(CONTENT_FILE, content)
+        save_section("about_page", ap)
         flash("Страница «Обо мне» сохранена", "success")
         return redirect(url_for("admin_about"))
     return render_template("admin/edit_about.html", content=content)
@@ -467,7 +848,7 @@ def admin_about():
 @app.route("/admin/services", methods=["GET", "POST"])
 @login_required
 def admin_services():
-    content = get_content()
+    content = {"services_page": get_section("services_page")}
     if request.method == "POST":
         sp = content["services_page"]
         sp["label"] = request.form.get("page_label", sp.get("label", ""))
@@ -508,7 +889,7 @@ def admin_services():
         cta["text"] = request.form.get("cta_text", cta["text"])
         cta["button_text"] = request.form.get("cta_button_text", cta["button_text"])
 
-        save_json(CONTENT_FILE, content)
+        save_section("services_page", sp)
         flash("Услуги сохранены", "success")
         return redirect(url_for("admin_services"))
     return render_template("admin/edit_services.html", content=content)
@@ -519,7 +900,7 @@ def admin_services():
 @app.route("/admin/contact", methods=["GET", "POST"])
 @login_required
 def admin_contact():
-    content = get_content()
+    content = {"contact_page": get_section("contact_page")}
     if request.method == "POST":
         cp = content["contact_page"]
         cp["label"] = request.form.get("label", cp.get("label", ""))
@@ -544,7 +925,7 @@ def admin_contact():
         cta["text"] = request.form.get("cta_text", cta["text"])
         cta["button_text"] = request.form.get("cta_button_text", cta["button_text"])
 
-        save_json(CONTENT_FILE, content)
+        save_section("contact_page", cp)
         flash("Страница контактов сохранена", "success")
         return redirect(url_for("admin_contact"))
     return render_template("admin/edit_contact.html", content=content)
@@ -555,18 +936,17 @@ def admin_contact():
 @app.route("/admin/articles", methods=["GET", "POST"])
 @login_required
 def admin_articles():
-    content = get_content()
+    content = {"articles_cta": get_section("articles_cta", {})}
     if request.method == "POST":
-        acta = content.get("articles_cta", {})
+        acta = content["articles_cta"]
         acta["title"] = request.form.get("cta_title", acta.get("title", ""))
         acta["text"] = request.form.get("cta_text", acta.get("text", ""))
         acta["button_text"] = request.form.get("cta_button_text", acta.get("button_text", ""))
-        content["articles_cta"] = acta
-        save_json(CONTENT_FILE, content)
+        save_section("articles_cta", acta)
         flash("CTA статей сохранён", "success")
         return redirect(url_for("admin_articles"))
-    artcls = get_articles()
-    return render_template("admin/articles_list.html", articles=artcls, content=content)
+    return render_template("admin/articles_list.html", page=list_page("articles"),
+                           counts=list_index("articles").counts(), content=content)
 
 
 def slugify(text):
@@ -600,6 +980,126 @@ def ensure_unique_slug(slug, items, exclude_item=None):
     return f"{slug}-{counter}"
 
 
+# Article bodies live in their own files (data/articles/<body>.json) so that
+# lists, slug lookups and the sitemap never parse them. The index entry keeps
+# what the lists show: reading time, word count and an automatic lead.
+# Deleting an article keeps its body file, so reverting the deletion from the
+# history brings the text back; prune_article_bodies removes it on a deploy
+# once the retained history no longer mentions it.
+
+def article_body_file(art):
+    return os.path.join(current_tenant().articles_dir, f"{art['body']}.json")
+
+
+def get_article_body(art):
+    """Body of an article: the editor's HTML ``content`` and its ``prepared`` artifacts."""
+    path = article_body_file(art) if art.get("body") else None
+    if path is None or not os.path.exists(path):
+        return {"content": "", "prepared": None}
+    return journal.view(path)
+
+
+def set_article_body(art, content, note=None):
+    """Store the body of ``art`` and refresh the summary kept in its index entry."""
+    art.setdefault("body", secrets.token_hex(6))  # file name stays the same when the slug changes
+    prep = prepare_article(content, current_tenant().static_dir, slugify)
+    save_json(article_body_file(art), {"content": content, "prepared": prep}, note=note)
+    art["reading_time"] = prep["reading_time"]
+    art["word_count"] = prep["word_count"]
+    art["lead"] = excerpt_from_text(prep["text"])
+    return art
+
+
+def _body_ids(value):
+    """``body`` ids found anywhere in an index value (an article, the list, a field)."""
+    if isinstance(value, dict):
+        if isinstance(value.get("body"), str):
+            yield value["body"]
+        for v in value.values():
+            yield from _body_ids(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _body_ids(v)
+
+
+def prune_article_bodies():
+    """Remove body files that neither the article index nor its history refers to.
+
+    Returns the number of removed bodies. Holds ``edits_lock`` so a save that
+    has written a new body but not yet its index entry is never cut in half.
+    """
+    t = current_tenant()
+    if not os.path.isdir(t.articles_dir):
+        return 0
+    with journal.locked(t.edits_lock), journal.locked(t.articles_dir):
+        used = set(_body_ids(journal.view(t.articles_file))) if os.path.exists(t.articles_file) else set()
+        for record in journal.revisions(t.articles_file):
+            for change in record["changes"]:
+                values = [change[key] for key in ("o", "n") if key in change]
+                if change["p"] and change["p"][-1] == "body":
+                    used.update(v for v in values if isinstance(v, str))
+                used.update(_body_ids(values))
+        removed = 0
+        for name in os.listdir(t.articles_dir):
+            if not name.endswith(".json") or name[:-len(".json")] in used:
+                continue
+            path = os.path.join(t.articles_dir, name)
+            for suffix in ("", ".journal", ".history", ".lock"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            removed += 1
+    return removed
+
+
+def prepared(body):
+    """Return the body's artifacts, computing them if missing or stale."""
+    prep = body.get("prepared")
+    if not prep or prep.get("version") != PREP_VERSION:
+        prep = prepare_article(body.get("content", ""), current_tenant().static_dir, slugify)
+    return prep
+
+
+def split_articles(tenant):
+    """Move article bodies stored inline in articles.json into their own files.
+
+    A one-time migration of the old format; also run after imports and
+    history reverts, which may bring inline bodies back.
+    """
+    with tenants.activate(tenant), journal.locked(tenant.articles_dir):
+        if not os.path.exists(tenant.articles_file):
+            return
+        artcls = journal.load(tenant.articles_file)
+        inline = [a for a in artcls if "content" in a]
+        if not inline:
+            return
+        for art in inline:
+            art.pop("prepared", None)
+            set_article_body(art, art.pop("content"))
+        save_articles(artcls, note="Тексты статей вынесены в отдельные файлы")
+
+
+for _tenant in tenants.all_tenants():
+    split_articles(_tenant)
+
+
+@app.cli.command("prepare-articles")
+def prepare_articles_command():
+    """Backfill render-ready artifacts for every stored article."""
+    for t in tenants.all_tenants():
+        with tenants.activate(t):
+            artcls = get_articles()
+            upgraded = 0
+            for art in artcls:
+                body = get_article_body(art)
+                prep = body.get("prepared")
+                if not prep or prep.get("version") != PREP_VERSION:
+                    set_article_body(art, body.get("content", ""))
+                    upgraded += 1
+            if upgraded:
+                save_articles(artcls)
+            print(f"[{t.key}] Подготовлено статей: {upgraded} из {len(artcls)}")
+
+
 @app.route("/admin/articles/new", methods=["GET", "POST"])
 @login_required
 def admin_article_new():
@@ -617,11 +1117,14 @@ def admin_article_new():
             "title": title,
             "image": image_path,
             "excerpt": request.form.get("excerpt", "").strip(),
-            "content": request.form.get("content", "").strip(),
             "published": "published" in request.form,
+            "publish_at": request.form.get("publish_at", "").strip(),
+            "unpublish_at": request.form.get("unpublish_at", "").strip(),
         }
+        drop_past_unpublish(new_article)
+        set_article_body(new_article, request.form.get("content", "").strip())
         artcls.append(new_article)
-        save_json(ARTICLES_FILE, artcls)
+        save_articles(artcls)
         flash("Статья создана", "success")
         return redirect(url_for("admin_articles"))
     return render_template("admin/edit_article.html", article=None, is_new=True)
@@ -634,6 +1137,7 @@ def admin_article_edit(slug):
     art = next((a for a in artcls if a["slug"] == slug), None)
     if art is None:
         abort(404)
+    body = get_article_body(art)
 
     if request.method == "POST":
         art["title"] = request.form.get("title", art["title"]).strip()
@@ -647,7 +1151,7 @@ def admin_article_edit(slug):
                 # Delete old image if it was an upload
                 old_image = art.get("image", "")
                 if old_image and old_image.startswith("uploads/"):
-                    old_path = os.path.join(app.static_folder, old_image)
+                    old_path = os.path.join(current_tenant().static_dir, old_image)
                     if os.path.exists(old_path):
                         os.remove(old_path)
                 art["image"] = new_image
@@ -655,17 +1159,21 @@ def admin_article_edit(slug):
         if request.form.get("remove_image") == "1":
             old_image = art.get("image", "")
             if old_image and old_image.startswith("uploads/"):
-                old_path = os.path.join(app.static_folder, old_image)
+                old_path = os.path.join(current_tenant().static_dir, old_image)
                 if os.path.exists(old_path):
                     os.remove(old_path)
             art["image"] = ""
         art["excerpt"] = request.form.get("excerpt", art["excerpt"]).strip()
-        art["content"] = request.form.get("content", art["content"]).strip()
         art["published"] = "published" in request.form
-        save_json(ARTICLES_FILE, artcls)
+        art["publish_at"] = request.form.get("publish_at", "").strip()
+        art["unpublish_at"] = request.form.get("unpublish_at", "").strip()
+        drop_past_unpublish(art)
+        set_article_body(art, request.form.get("content", body.get("content", "")).strip())
+        save_articles(artcls)
         flash("Статья обновлена", "success")
         return redirect(url_for("admin_articles"))
-    return render_template("admin/edit_article.html", article=art, is_new=False)
+    return render_template("admin/edit_article.html", article=dict(art, content=body.get("content", "")),
+                           is_new=False)
 
 
 @app.route("/admin/articles/<slug>/delete", methods=["POST"])
@@ -676,11 +1184,11 @@ def admin_article_delete(slug):
     if idx is not None:
         art = artcls[idx]
         if art.get("image", "").startswith("uploads/"):
-            old_path = os.path.join(app.static_folder, art["image"])
+            old_path = os.path.join(current_tenant().static_dir, art["image"])
             if os.path.exists(old_path):
                 os.remove(old_path)
         artcls.pop(idx)
-    save_json(ARTICLES_FILE, artcls)
+    save_articles(artcls)
     flash("Статья удалена", "success")
     return redirect(url_for("admin_articles"))
 
@@ -704,8 +1212,8 @@ def admin_upload():
 @app.route("/admin/announcements")
 @login_required
 def admin_announcements():
-    anns = get_announcements()
-    return render_template("admin/announcements_list.html", announcements=anns)
+    return render_template("admin/announcements_list.html", page=list_page("announcements"),
+                           counts=list_index("announcements").counts())
 
 
 @app.route("/admin/announcements/new", methods=["GET", "POST"])
@@ -729,9 +1237,12 @@ def admin_announcement_new():
             "description": request.form.get("description", "").strip(),
             "image": image_path,
             "published": "published" in request.form,
+            "publish_at": request.form.get("publish_at", "").strip(),
+            "unpublish_at": request.form.get("unpublish_at", "").strip(),
         }
+        drop_past_unpublish(new_ann)
         anns.append(new_ann)
-        save_json(ANNOUNCEMENTS_FILE, anns)
+        save_announcements(anns)
         flash("Анонс создан", "success")
         return redirect(url_for("admin_announcements"))
     return render_template("admin/edit_announcement.html", announcement=None, is_new=True)
@@ -760,19 +1271,22 @@ def admin_announcement_edit(slug):
             if new_image:
                 old_image = ann.get("image", "")
                 if old_image and old_image.startswith("uploads/"):
-                    old_path = os.path.join(app.static_folder, old_image)
+                    old_path = os.path.join(current_tenant().static_dir, old_image)
                     if os.path.exists(old_path):
                         os.remove(old_path)
                 ann["image"] = new_image
         if request.form.get("remove_image") == "1":
             old_image = ann.get("image", "")
             if old_image and old_image.startswith("uploads/"):
-                old_path = os.path.join(app.static_folder, old_image)
+                old_path = os.path.join(current_tenant().static_dir, old_image)
                 if os.path.exists(old_path):
                     os.remove(old_path)
             ann["image"] = ""
         ann["published"] = "published" in request.form
-        save_json(ANNOUNCEMENTS_FILE, anns)
+        ann["publish_at"] = request.form.get("publish_at", "").strip()
+        ann["unpublish_at"] = request.form.get("unpublish_at", "").strip()
+        drop_past_unpublish(ann)
+        save_announcements(anns)
         flash("Анонс обновлён", "success")
         return redirect(url_for("admin_announcements"))
     return render_template("admin/edit_announcement.html", announcement=ann, is_new=False)
@@ -786,11 +1300,11 @@ def admin_announcement_delete(slug):
     if idx is not None:
         ann = anns[idx]
         if ann.get("image", "").startswith("uploads/"):
-            old_path = os.path.join(app.static_folder, ann["image"])
+            old_path = os.path.join(current_tenant().static_dir, ann["image"])
             if os.path.exists(old_path):
                 os.remove(old_path)
         anns.pop(idx)
-    save_json(ANNOUNCEMENTS_FILE, anns)
+    save_announcements(anns)
     flash("Анонс удалён", "success")
     return redirect(url_for("admin_announcements"))
 
@@ -800,13 +1314,13 @@ def admin_announcement_delete(slug):
 @app.route("/admin/documents", methods=["GET", "POST"])
 @login_required
 def admin_documents():
-    content = get_content()
-    dp = content.setdefault("documents_page", {
+    dp = get_section("documents_page", {
         "title": "Документы и сертификаты",
         "subtitle": "",
         "button_text": "Смотреть документы",
         "docs": [],
     })
+    content = {"documents_page": dp}
 
     if request.method == "POST":
         dp["title"] = request.form.get("title", dp["title"]).strip()
@@ -831,7 +1345,7 @@ def admin_documents():
             if did in old_map:
                 img = old_map[did].get("image", "")
                 if img and img.startswith("uploads/"):
-                    abs_path = os.path.join(app.static_folder, img)
+                    abs_path = os.path.join(current_tenant().static_dir, img)
                     if os.path.exists(abs_path):
                         os.remove(abs_path)
         new_items = [item for i, item in enumerate(new_items)
@@ -848,95 +1362,623 @@ def admin_documents():
                     new_items.append({"image": path, "title": title})
 
         dp["docs"] = new_items
-        save_json(CONTENT_FILE, content)
+        save_section("documents_page", dp)
         flash("Документы сохранены", "success")
         return redirect(url_for("admin_documents"))
 
     return render_template("admin/edit_documents.html", content=content)
 
 
-# ─── Deploy: build & push ──────────────────────────────────────
+# ─── Admin: Пакетные операции ──────────────────────────────────
+
+# kind -> (id key, allowed operations, list page endpoint)
+BATCH_KINDS = {
+    "articles": ("slug", batch.OPERATIONS, "admin_articles"),
+    "announcements": ("slug", batch.OPERATIONS, "admin_announcements"),
+    "documents": ("image", {"delete", "reorder"}, "admin_documents"),
+}
+
+
+def batch_ops_from_form(all_ids):
+    """Operations submitted by the list-view controls.
+
+    A list page may show only some of the items. The shown items take the
+    positions typed in; the others keep theirs and make room.
+    """
+    op = request.form.get("op", "")
+    if op == "reorder":
+        ids = request.form.getlist("item_id")
+        positions = request.form.getlist("position")
+
+        def position(i):
+            try:
+                return int(positions[i])
+            except (IndexError, ValueError):
+                return i + 1
+        typed = {ids[i]: position(i) for i in range(len(ids))}
+        current = {item_id: n for n, item_id in enumerate(all_ids, 1)}
+        # On a tie the item that was moved goes first
+        order = sorted(all_ids, key=lambda item_id: (typed.get(item_id, current[item_id]), item_id not in typed))
+        return [{"op": "reorder", "order": order}]
+    return [{"op": op, "id": item_id} for item_id in request.form.getlist("selected")]
+
+
+def remove_unused_uploads(paths):
+    """Delete uploaded files no data file refers to any more, with their metadata."""
+    still_used = set(referenced_images())
+    unused = [p for p in set(paths) if p and p.startswith("uploads/") and p not in still_used]
+    for rel in unused:
+        abs_path = os.path.join(current_tenant().static_dir, rel)
+        if os.path.exists(abs_path):
+            os.remove(abs_path)
+    if unused:
+        image_meta.forget(current_tenant().images_file, unused)
+    return unused
+
+
+@app.route("/admin/batch/<kind>", methods=["POST"])
+@login_required
+def admin_batch(kind):
+    """Apply many operations with one load, one validation pass and one write.
 
-deploy_status = {"running": False, "log": [], "last_result": None}
+    Accepts JSON ``{"ops": [...]}`` (see batch.py) or the list-view form.
+    """
+    if kind not in BATCH_KINDS:
+        abort(404)
+    key, allowed, list_endpoint = BATCH_KINDS[kind]
+    if kind == "documents":
+        dp = get_section("documents_page", {"docs": []})
+        items = dp.get("docs", [])
+    else:
+        items = get_articles() if kind == "articles" else get_announcements()
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get("ops"), list):
+            return jsonify({"ok": False, "errors": ['Ожидается объект {"ops": [...]}']}), 400
+        ops = payload["ops"]
+    else:
+        ops = batch_ops_from_form([item.get(key) for item in items])
+    now = site_now()
+    new_items, removed, errors = batch.apply(items, ops, key, allowed, now)
+    if new_items is not None and kind != "documents":
+        live = is_live_announcement if kind == "announcements" else is_live
+        for n, op in enumerate(ops, 1):
+            item = next((it for it in new_items if it.get(key) == op.get("id")), None)
+            if op.get("op") == "publish" and item is not None and not live(item, now):
+                errors.append(f"#{n}: {op['id']!r} не появится на сайте: срок публикации истёк")
+
+    if errors:
+        if request.is_json:
+            return jsonify({"ok": False, "errors": errors}), 400
+        for error in errors:
+            flash(error, "error")
+        return redirect(url_for(list_endpoint, **request.args))
+
+    note = f"Пакетная операция: {len(ops)}"
+    if kind == "documents":
+        dp["docs"] = new_items
+        rev = save_section("documents_page", dp, note=note)
+    else:
+        rev = (save_articles if kind == "articles" else save_announcements)(new_items, note=note)
+    removed_files = remove_unused_uploads(item.get("image") for item in removed)
 
+    if request.is_json:
+        return jsonify({"ok": True, "rev": rev, "applied": len(ops), "removed_files": removed_files})
+    flash(f"Применено операций: {len(ops)}", "success")
+    return redirect(url_for(list_endpoint, **request.args))  # back to the same list page
 
-def run_deploy():
-    """Build static site and push to GitHub in a background thread."""
-    deploy_status["running"] = True
-    deploy_status["log"] = []
-    deploy_status["last_result"] = None
-    log = deploy_status["log"]
-    project_dir = os.path.dirname(os.path.abspath(__file__))
 
-    try:
-        log.append("🔨 Сборка статического сайта...")
-        result = subprocess.run(
-            ["python", "freeze.py"],
-            capture_output=True, text=True, cwd=project_dir, timeout=120
-        )
-        if result.returncode != 0:
-            log.append(f"❌ Ошибка сборки:\n{result.stderr}")
-            deploy_status["last_result"] = "error"
-            return
-        log.append("✅ Сборка завершена")
-
-        log.append("📦 Коммит изменений...")
-        subprocess.run(["git", "add", "-A"], capture_output=True, text=True, cwd=project_dir)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-        result = subprocess.run(
-            ["git", "commit", "-m", f"Обновление контента — {timestamp}"],
-            capture_output=True, text=True, cwd=project_dir
-        )
-        if result.returncode != 0 and "nothing to commit" in result.stdout:
-            log.append("ℹ️ Нет изменений для коммита")
-        elif result.returncode != 0:
-            log.append(f"❌ Ошибка git commit:\n{result.stderr}")
-            deploy_status["last_result"] = "error"
-            return
+# ─── Admin: Резервная копия ────────────────────────────────────
+
+BACKUP_MAX_SIZE = 4 * 1024 ** 3  # imports are streamed, the form upload limit does not apply
+
+
+def project_path(path):
+    return os.path.relpath(path, current_tenant().root).replace(os.sep, "/")
+
+
+def backup_entries():
+    """Current state of every data file plus the uploads they reference."""
+    t = current_tenant()
+    files = data_files() + [t.images_file]
+    data = {project_path(p): journal.view(p) for p in files if os.path.exists(p)}
+    static_dir = project_path(t.static_dir)
+    uploads = [f"{static_dir}/{p}" for p in referenced_uploads()]
+    return backup.collect(t.root, data, uploads)
+
+
+def restore_data(data, staged=None):
+    """Write imported data files and move staged uploads into place, all or nothing.
+
+    Journaled files keep their history. If any step fails, the files already
+    written are put back to their previous state and the error is re-raised.
+    The request holds the edits lock, so a build never sees half an import.
+    """
+    t = current_tenant()
+    paths = {rel: os.path.join(t.root, rel) for rel in data}
+    previous = {path: journal.load(path) if os.path.exists(path) else None for path in paths.values()}
+
+    def write(path, value, note):
+        if path == t.images_file:
+            with journal.locked(path):
+                journal.write_snapshot(path, value)
         else:
-            log.append("✅ Изменения закоммичены")
-
-        log.append("🚀 Отправка на GitHub...")
-        result = subprocess.run(
-            ["git", "push", "-u", "origin", "HEAD:main"],
-            capture_output=True, text=True, cwd=project_dir, timeout=60
-        )
-        if result.returncode != 0:
-            log.append(f"❌ Ошибка git push:\n{result.stderr}")
-            deploy_status["last_result"] = "error"
-            return
-        log.append("✅ Отправлено в GitHub")
-        log.append("🎉 Деплой завершён! GitHub Actions опубликует сайт через 1-2 минуты.")
-        deploy_status["last_result"] = "success"
+            save_json(path, value, note=note)
+
+    written = []
+    try:
+        for rel, value in data.items():
+            written.append(paths[rel])
+            write(paths[rel], value, "Импорт резервной копии")
+        split_articles(t)  # archives made before bodies got their own files
+        backup.restore_uploads(t.root, staged or {})
+    except Exception:
+        for path in reversed(written):
+            if previous[path] is None:
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                write(path, previous[path], "Отмена неудачного импорта")
+        raise
+
+
+@app.route("/admin/backup")
+@login_required
+def admin_backup():
+    return render_template("admin/backup.html")
 
-    except subprocess.TimeoutExpired:
-        log.append("❌ Таймаут операции")
-        deploy_status["last_result"] = "error"
+
+@app.route("/admin/export")
+@login_required
+def admin_export():
+    entries = backup_entries()
+    filename = f"backup-{datetime.now():%Y%m%d-%H%M}.tar"
+    return Response(backup.stream_tar(current_tenant().root, entries), mimetype="application/x-tar",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.route("/admin/import", methods=["POST"])
+@login_required
+def admin_import():
+    """Restore from an export: a form upload or the raw archive as the request body."""
+    request.max_content_length = BACKUP_MAX_SIZE
+    raw = request.mimetype in ("application/x-tar", "application/octet-stream")
+    if raw:
+        stream = request.stream
+    else:
+        archive = request.files.get("archive")
+        stream = archive.stream if archive and archive.filename else None
+    if stream is None:
+        flash("Выберите файл архива", "error")
+        return redirect(url_for("admin_backup"))
+
+    try:
+        data, staged, skipped, staging_dir = backup.read_archive(stream, current_tenant().root)
+    except backup.BackupError as e:
+        if raw:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        flash(str(e), "error")
+        return redirect(url_for("admin_backup"))
+    try:
+        restore_data(data, staged)
     except Exception as e:
-        log.append(f"❌ Ошибка: {e}")
-        deploy_status["last_result"] = "error"
+        app.logger.exception("Backup import failed")
+        if raw:
+            return jsonify({"ok": False, "error": f"Не удалось восстановить, ничего не изменено: {e}"}), 500
+        flash(f"Не удалось восстановить, ничего не изменено: {e}", "error")
+        return redirect(url_for("admin_backup"))
     finally:
-        deploy_status["running"] = False
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    if raw:
+        return jsonify({"ok": True, "data": len(data), "uploads": len(staged), "skipped": len(skipped)})
+    flash(f"Восстановлено: файлов данных {len(data)}, изображений {len(staged)} "
+          f"(уже были на месте: {len(skipped)})", "success")
+    return redirect(url_for("admin_backup"))
+
+
+# ─── Admin: История изменений ──────────────────────────────────
+
+def history_file(name):
+    """Data file behind a history page: a content section, articles, an article text or announcements."""
+    if name == "article-text":
+        art = next((a for a in get_articles() if a["slug"] == request.values.get("slug")), None)
+        if art is None or not art.get("body"):
+            abort(404)
+        return article_body_file(art)
+    if name == "articles":
+        return current_tenant().articles_file
+    if name == "announcements":
+        return current_tenant().announcements_file
+    if name in content_sections():
+        return section_file(name)
+    abort(404)
+
+
+def history_prefix(name):
+    """Journal path prefix for the item selected in the query string."""
+    if request.values.get("slug") and name != "article-text":
+        return [{"slug": request.values["slug"]}]
+    return []
+
+
+@app.template_filter("change_path")
+def change_path_filter(path):
+    return " › ".join(seg["slug"] if isinstance(seg, dict) else str(seg) for seg in path)
+
+
+@app.template_filter("change_value")
+def change_value_filter(value, limit=120):
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+@app.route("/admin/history/<name>")
+@login_required
+def admin_history(name):
+    revs = journal.revisions(history_file(name), history_prefix(name))
+    return render_template("admin/history.html", name=name, revisions=revs,
+                           sections=content_sections(), slug=request.args.get("slug", ""))
+
+
+@app.route("/admin/history/<name>/<int:rev>/revert", methods=["POST"])
+@login_required
+def admin_history_revert(name, rev):
+    try:
+        new_rev = journal.revert(history_file(name), rev, history_prefix(name), missing_files)
+    except journal.RevertMissingFiles as e:
+        flash(f"Ревизию {rev} нельзя откатить: нужные ей файлы уже удалены ({e})", "error")
+        return redirect(url_for("admin_history", name=name, slug=request.form.get("slug") or None))
+    except journal.RevertConflict as e:
+        flash(f"Ревизию {rev} нельзя откатить: эти поля изменены позже ({e})", "error")
+        return redirect(url_for("admin_history", name=name, slug=request.form.get("slug") or None))
+    if name == "articles":
+        split_articles(current_tenant())  # reverting old revisions may restore inline bodies
+    if new_rev is None:
+        flash("Нечего откатывать", "error")
+    else:
+        flash(f"Изменения ревизии {rev} отменены", "success")
+    return redirect(url_for("admin_history", name=name, slug=request.form.get("slug") or None))
+
+
+# ─── Admin: Профилировщик ──────────────────────────────────────
+
+def profiles_dir_for(environ):
+    """Profiles of the site a request is for; each site arms and reads only its own."""
+    tenant = tenants.for_host(environ.get("HTTP_HOST") or environ.get("SERVER_NAME", ""))
+    return tenant.profiles_dir if tenant else None
+
+
+app.wsgi_app = profiler.Profiler(app.wsgi_app, app, profiles_dir_for)
+
+
+def profiled_endpoints():
+    return sorted(r.endpoint for r in app.url_map.iter_rules()
+                  if r.endpoint != "static" and not r.endpoint.startswith("admin_profiler"))
+
+
+@app.route("/admin/profiler")
+@login_required
+def admin_profiler():
+    directory = current_tenant().profiles_dir
+    return render_template("admin/profiler.html", config=profiler.get_config(directory),
+                           profiles=profiler.list_profiles(directory), endpoints=profiled_endpoints(),
+                           fragments=app.jinja_env.fragment_cache.report())
+
+
+@app.route("/admin/profiler/arm", methods=["POST"])
+@login_required
+def admin_profiler_arm():
+    endpoint = request.form.get("endpoint", "")
+    if endpoint and endpoint not in profiled_endpoints():
+        abort(400)
+    try:
+        count = max(1, min(int(request.form.get("count") or 5), 100))
+        threshold = max(0, int(request.form.get("threshold_ms") or 0))
+        interval = max(1, min(int(request.form.get("interval_ms") or profiler.DEFAULT_INTERVAL_MS), 100))
+    except ValueError:
+        flash("Введите целые числа", "error")
+        return redirect(url_for("admin_profiler"))
+    profiler.arm(current_tenant().profiles_dir, count, endpoint, threshold, interval)
+    flash("Профилировщик включён", "success")
+    return redirect(url_for("admin_profiler"))
+
+
+@app.route("/admin/profiler/disarm", methods=["POST"])
+@login_required
+def admin_profiler_disarm():
+    profiler.disarm(current_tenant().profiles_dir)
+    flash("Профилировщик выключен", "success")
+    return redirect(url_for("admin_profiler"))
+
+
+@app.route("/admin/profiler/clear", methods=["POST"])
+@login_required
+def admin_profiler_clear():
+    profiler.clear(current_tenant().profiles_dir)
+    flash("Профили удалены", "success")
+    return redirect(url_for("admin_profiler"))
+
+
+@app.route("/admin/profiler/<name>")
+@login_required
+def admin_profiler_view(name):
+    files = profiler.profile_files(current_tenant().profiles_dir, name) or abort(404)
+    with open(files[0], "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return render_template("admin/profile.html", profile=meta, hottest=profiler.hottest(files[1]))
+
+
+@app.route("/admin/profiler/<name>.folded")
+@login_required
+def admin_profiler_download(name):
+    files = profiler.profile_files(current_tenant().profiles_dir, name) or abort(404)
+    return send_file(files[1], mimetype="text/plain", as_attachment=True, download_name=name + ".folded")
+
+
+# ─── Deploy: build & push ──────────────────────────────────────
+
+def publish_build(tenant, message):
+    """Push ``build/`` to the pages branch as one commit without history.
+
+    GitHub Pages serves that branch as is. A temporary index turns the build
+    into a tree, so the source checkout is untouched. Only objects the remote
+    does not have yet are sent, and images dropped from the site stop being
+    referenced instead of piling up in history.
+    """
+    git_dir = subprocess.run(["git", "rev-parse", "--absolute-git-dir"], capture_output=True, text=True,
+                             cwd=tenant.root, check=True).stdout.strip()
+    env = dict(os.environ, GIT_DIR=git_dir, GIT_WORK_TREE=tenant.build_dir,
+               GIT_INDEX_FILE=os.path.join(git_dir, "pages-index"))
+
+    def git(*args, timeout=None):
+        return subprocess.run(["git", *args], capture_output=True, text=True, cwd=tenant.build_dir,
+                              env=env, timeout=timeout, check=True).stdout.strip()
+
+    open(os.path.join(tenant.build_dir, ".nojekyll"), "a").close()  # serve files as built, no Jekyll pass
+    git("read-tree", "--empty")
+    git("add", "-A", "--force", ".")
+    commit = git("commit-tree", git("write-tree"), "-m", message)
+    git("push", "--force", tenant.git_remote, f"{commit}:refs/heads/{tenant.pages_branch}", timeout=120)
+
+
+def run_deploy(tenant, only_urls=None, message=None, log=None):
+    """Build a site's static copy and push it to GitHub; runs in the tenant's deploy queue.
+
+    ``only_urls`` limits the build to the given pages (incremental build),
+    ``message`` overrides the commit message. The data files and the uploads
+    manifest go to ``git_branch``, the built site to ``pages_branch``.
+    Returns "success" or "error".
+    """
+    log = [] if log is None else log
+    with tenants.activate(tenant):
+        try:
+            for path in data_files():
+                journal.compact(path)
+            if prune_article_bodies():
+                log.append("🧹 Удалены тексты статей, которых нет ни в списке, ни в истории")
+            missing = sync_uploads()
+            if missing:
+                log.append(f"⚠️ Нет файлов: {', '.join(missing)}")
+            log.append("🔨 Сборка статического сайта...")
+            cmd = ["python", "freeze.py", "--tenant", tenant.key]
+            if only_urls:
+                cmd += ["--only", *only_urls]
+            result = subprocess.run(
+                cmd,
+                capture_output=True, text=True, cwd=APP_DIR, timeout=120
+            )
+            if result.returncode != 0:
+                log.append(f"❌ Ошибка сборки:\n{result.stderr}")
+                return "error"
+            log.append("✅ Сборка завершена")
+
+            log.append("📦 Коммит изменений...")
+            # Uploads live in the object store now; drop copies tracked by older versions
+            subprocess.run(["git", "rm", "-r", "-q", "--cached", "--ignore-unmatch", "static/uploads", "build"],
+                           capture_output=True, text=True, cwd=tenant.root)
+            subprocess.run(["git", "add", "-A"], capture_output=True, text=True, cwd=tenant.root)
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
+            commit_message = f"{message or 'Обновление контента'} — {timestamp}"
+            result = subprocess.run(
+                ["git", "commit", "-m", commit_message],
+                capture_output=True, text=True, cwd=tenant.root
+            )
+            if result.returncode != 0 and "nothing to commit" in result.stdout:
+                log.append("ℹ️ Нет изменений для коммита")
+            elif result.returncode != 0:
+                log.append(f"❌ Ошибка git commit:\n{result.stderr}")
+                return "error"
+            else:
+                log.append("✅ Изменения закоммичены")
+
+            log.append("🚀 Отправка на GitHub...")
+            result = subprocess.run(
+                ["git", "push", "-u", tenant.git_remote, f"HEAD:{tenant.git_branch}"],
+                capture_output=True, text=True, cwd=tenant.root, timeout=60
+            )
+            if result.returncode != 0:
+                log.append(f"❌ Ошибка git push:\n{result.stderr}")
+                return "error"
+            try:
+                publish_build(tenant, commit_message)
+            except subprocess.CalledProcessError as e:
+                log.append(f"❌ Ошибка публикации сайта:\n{e.stderr}")
+                return "error"
+            log.append("✅ Отправлено в GitHub")
+            log.append(f"🎉 Деплой завершён! GitHub Pages обновит сайт из ветки {tenant.pages_branch} через 1-2 минуты.")
+            return "success"
+
+        except subprocess.TimeoutExpired:
+            log.append("❌ Таймаут операции")
+            return "error"
+
+
+# One queue per site: builds of a site never overlap, different sites build independently
+for _tenant in tenants.all_tenants():
+    _tenant.deploy = DeployQueue(
+        lambda only, message, log, t=_tenant: run_deploy(t, only, message, log),
+        os.path.join(_tenant.data_dir, ".deploy.lock"),
+        os.path.join(_tenant.data_dir, ".deploy.json"),
+    )
+
+
+@app.cli.command("builds")
+def builds_command():
+    """List the kept builds of every site; the current one is marked."""
+    for t in tenants.all_tenants():
+        active = builds.current(t.build_dir)
+        for build_id in builds.history(t.builds_dir):
+            mark = "→" if os.path.join(t.builds_dir, build_id) == active else " "
+            print(f"[{t.key}] {mark} {build_id}")
+
+
+@app.cli.command("rollback")
+@click.argument("build_id", required=False)
+def rollback_command(build_id):
+    """Switch build/ back to an earlier build (the previous one by default) and publish it."""
+    t = current_tenant()
+    with open(t.deploy.lock_path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # not in the middle of a deploy
+        ids = builds.history(t.builds_dir)
+        active = builds.current(t.build_dir)
+        position = ids.index(os.path.basename(active)) if active and os.path.basename(active) in ids else len(ids)
+        if build_id is None:
+            build_id = ids[position - 1] if position > 0 else None
+        if build_id not in ids:
+            raise click.ClickException("Нет такой сборки. Список: flask --app app builds")
+        builds.switch(t.build_dir, os.path.join(t.builds_dir, build_id))
+        print(f"[{t.key}] build/ → builds/{build_id}")
+        publish_build(t, f"Откат к сборке {build_id}")
+        print(f"[{t.key}] Опубликовано в {t.pages_branch}")
+
+
+# ─── Scheduler: timed publish / unpublish ──────────────────────
+
+def apply_due_transitions(now):
+    """Materialize publish/unpublish/expiry times that have passed.
+
+    Flips ``published`` in the data files so the change is committed and
+    picked up by the GitHub Pages build. Returns the list of affected URLs,
+    empty if nothing was due.
+    """
+    urls = set()
+
+    def transition(item):
+        changed = False
+        publish_at = parse_dt(item.get("publish_at"))
+        unpublish_at = parse_dt(item.get("unpublish_at"))
+        if publish_at and publish_at <= now:
+            item["published"] = True
+            item["publish_at"] = ""
+            changed = True
+        if unpublish_at and unpublish_at <= now and item.get("published"):
+            item["published"] = False  # unpublish_at stays: the item shows as expired
+            changed = True
+        return changed
+
+    artcls = get_articles()
+    changed_articles = [a for a in artcls if transition(a)]
+    if changed_articles:
+        save_articles(artcls)
+        urls.update(["/", "/articles/", "/sitemap.xml"])
+        urls.update(f"/articles/{a['slug']}/" for a in changed_articles)
+
+    anns = get_announcements()
+    changed_anns = False
+    for ann in anns:
+        changed_anns |= transition(ann)
+        expiry = expires_at(ann)
+        if ann.get("published") and expiry and expiry <= now:
+            ann["published"] = False
+            changed_anns = True
+    if changed_anns:
+        save_announcements(anns)
+        urls.update(["/", "/announcements/"])
+
+    return sorted(urls)
+
+
+def item_due(item, now, expiring=False):
+    """Whether a scheduled transition of the item has come."""
+    publish_at, unpublish_at = parse_dt(item.get("publish_at")), parse_dt(item.get("unpublish_at"))
+    if publish_at and publish_at <= now:
+        return True
+    if unpublish_at and unpublish_at <= now and item.get("published"):
+        return True
+    expiry = expires_at(item) if expiring else None
+    return bool(item.get("published") and expiry and expiry <= now)
+
+
+def has_due_transitions(now):
+    return (any(item_due(a, now) for a in get_articles())
+            or any(item_due(a, now, expiring=True) for a in get_announcements()))
+
+
+def scheduler_loop():
+    """Background loop; only the worker holding the lock file does any work."""
+    lock_file = open(os.path.join(DATA_DIR, ".scheduler.lock"), "w")
+    holding = False
+    batch_deadlines = {}   # tenant key -> when to apply its due transitions
+    while True:
+        time.sleep(SCHEDULER_INTERVAL)
+        if not holding:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                holding = True
+            except BlockingIOError:
+                continue
+        for tenant in tenants.all_tenants():
+            try:
+                with tenants.activate(tenant):
+                    schedule_tenant(tenant, batch_deadlines)
+            except Exception as e:
+                app.logger.error("Scheduler error (%s): %s", tenant.key, e)
+
+
+def schedule_tenant(tenant, batch_deadlines):
+    now = site_now()
+    deadline = batch_deadlines.get(tenant.key)
+    if deadline is None:
+        if has_due_transitions(now):
+            # Wait a little so items due shortly after go out together
+            batch_deadlines[tenant.key] = now + timedelta(seconds=SCHEDULER_BATCH_WINDOW)
+        return
+    if now < deadline or tenant.deploy.busy():
+        return
+    del batch_deadlines[tenant.key]
+    with journal.locked(tenant.edits_lock, shared=True):
+        urls = apply_due_transitions(now)
+    if urls:
+        tenant.deploy.submit(only_urls=urls, message="Плановая публикация")
+
+
+scheduler_started = False
+
+
+@app.before_request
+def start_scheduler():
+    global scheduler_started
+    if scheduler_started or not app.config["SCHEDULER_ENABLED"]:
+        return
+    scheduler_started = True
+    threading.Thread(target=scheduler_loop, daemon=True).start()
 
 
 @app.route("/admin/deploy", methods=["POST"])
 @login_required
 def admin_deploy():
-    if deploy_status["running"]:
-        return jsonify({"ok": False, "error": "Деплой уже выполняется"}), 409
-    thread = threading.Thread(target=run_deploy, daemon=True)
-    thread.start()
-    return jsonify({"ok": True})
+    # A deploy requested while another one runs waits for it (merged with other waiting ones)
+    queue = current_tenant().deploy
+    queued = queue.busy()
+    queue.submit()
+    return jsonify({"ok": True, "queued": queued})
 
 
 @app.route("/admin/deploy/status")
 @login_required
 def admin_deploy_status():
-    return jsonify({
-        "running": deploy_status["running"],
-        "log": deploy_status["log"],
-        "result": deploy_status["last_result"],
-    })
+    return jsonify(current_tenant().deploy.status())
 
 
 # ─── Error handlers ────────────────────────────────────────────
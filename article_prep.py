@@ -0,0 +1,215 @@
+"""
+Write-time preprocessing of article HTML.
+
+The admin editor (Quill) produces raw HTML. Instead of rendering it with
+``|safe`` on every request, the admin handlers call ``prepare_article`` once
+per save and store the render-ready artifacts next to the article.
+"""
+import math
+import os
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+import image_meta
+
+# Bump when the artifacts format changes so the backfill command upgrades
+# previously prepared articles.
+PREP_VERSION = 2
+
+WORDS_PER_MINUTE = 180
+
+ALLOWED_TAGS = {
+    "p", "br", "strong", "b", "em", "i", "u", "s", "span", "sub", "sup",
+    "h2", "h3", "h4", "ol", "ul", "li", "blockquote", "pre", "code",
+    "a", "img", "hr",
+}
+# HTML void elements: they never get an end tag, so they must not count
+# towards the depth of a dropped container
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+             "param", "source", "track", "wbr"}
+DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "template", "noscript"}
+HEADING_TAGS = {"h2", "h3", "h4"}
+BLOCK_TAGS = {"p", "h2", "h3", "h4", "li", "blockquote", "pre", "br", "hr"}
+
+ALLOWED_ATTRS = {
+    "a": {"href", "title", "target", "rel"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "*": {"class"},
+}
+ALLOWED_SCHEMES = {"", "http", "https", "mailto", "tel"}
+CLASS_RE = re.compile(r"^(ql-[\w-]+)(\s+ql-[\w-]+)*$")
+
+
+def _safe_url(value):
+    value = (value or "").strip()
+    scheme = urlparse(value).scheme.lower()
+    return value if scheme in ALLOWED_SCHEMES else ""
+
+
+def static_path(src, static_folder):
+    """Map an <img src> pointing into /static/ to a file path on disk."""
+    path = urlparse(src).path
+    marker = "/static/"
+    if marker in path:
+        rel = path.split(marker, 1)[1]
+    elif path.startswith("uploads/"):
+        rel = path
+    else:
+        return None
+    full = os.path.normpath(os.path.join(static_folder, rel))
+    if not full.startswith(os.path.normpath(static_folder) + os.sep):
+        return None
+    return full
+
+
+class _Preprocessor(HTMLParser):
+    def __init__(self, static_folder, slugify):
+        super().__init__(convert_charrefs=True)
+        self.static_folder = static_folder
+        self.slugify = slugify
+        self.out = []
+        self.text = []
+        self.toc = []
+        self.anchors = set()
+        self.open_tags = []
+        self.skip_depth = 0
+        self.heading = None  # (tag, index in self.out, collected text)
+
+    # -- helpers --
+
+    def _attrs(self, tag, attrs):
+        allowed = ALLOWED_ATTRS.get(tag, set()) | ALLOWED_ATTRS["*"]
+        clean = {}
+        for name, value in attrs:
+            name = name.lower()
+            if name not in allowed or value is None:
+                continue
+            if name in ("href", "src"):
+                value = _safe_url(value)
+                if not value:
+                    continue
+            if name == "class" and not CLASS_RE.match(value.strip()):
+                continue
+            if name in ("width", "height") and not value.isdigit():
+                continue
+            clean[name] = value
+        if tag == "a" and clean.get("target") == "_blank":
+            clean["rel"] = "noopener noreferrer"
+        if tag == "img":
+            clean["loading"] = "lazy"
+            clean["decoding"] = "async"
+            if "width" not in clean or "height" not in clean:
+                full = static_path(clean.get("src", ""), self.static_folder)
+                size = image_meta.size(full) if full else None
+                if size:
+                    clean["width"], clean["height"] = str(size[0]), str(size[1])
+            clean.setdefault("alt", "")
+        return clean
+
+    def _unique_anchor(self, text):
+        base = self.slugify(text) or "section"
+        anchor, n = base, 2
+        while anchor in self.anchors:
+            anchor = f"{base}-{n}"
+            n += 1
+        self.anchors.add(anchor)
+        return anchor
+
+    # -- parser callbacks --
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_depth or tag in DROP_CONTENT_TAGS:
+            if tag not in VOID_TAGS:
+                self.skip_depth += 1
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+        if tag not in ALLOWED_TAGS:
+            return
+        attrs = self._attrs(tag, attrs)
+        if tag == "img" and "src" not in attrs:
+            return
+        rendered = "".join(f' {k}="{escape(v, quote=True)}"' for k, v in attrs.items())
+        self.out.append(f"<{tag}{rendered}>")
+        if tag in HEADING_TAGS and self.heading is None:
+            self.heading = (tag, len(self.out) - 1, [])
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.skip_depth or tag in DROP_CONTENT_TAGS:
+            return  # self-closed, so there is no content to skip
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag in self.open_tags:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.skip_depth:
+            if tag not in VOID_TAGS:
+                self.skip_depth -= 1
+            return
+        if tag not in ALLOWED_TAGS or tag in VOID_TAGS or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            top = self.open_tags.pop()
+            self._close(top)
+            if top == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+
+    def _close(self, tag):
+        self.out.append(f"</{tag}>")
+        if self.heading and self.heading[0] == tag:
+            _, idx, parts = self.heading
+            title = " ".join("".join(parts).split())
+            if title:
+                anchor = self._unique_anchor(title)
+                self.out[idx] = self.out[idx][:-1] + f' id="{anchor}">'
+                self.toc.append({"id": anchor, "text": title, "level": int(tag[1])})
+            self.heading = None
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        self.out.append(escape(data, quote=False))
+        self.text.append(data)
+        if self.heading:
+            self.heading[2].append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self._close(self.open_tags.pop())
+
+
+def prepare_article(content, static_folder, slugify):
+    """Compute render-ready artifacts for an article body.
+
+    Returns a dict with sanitized ``html``, a ``toc`` list, ``word_count``,
+    ``reading_time`` (minutes) and a plain ``text`` version.
+    """
+    parser = _Preprocessor(static_folder, slugify)
+    parser.feed(content or "")
+    parser.close()
+    lines = ("".join(parser.text)).splitlines()
+    text = "\n".join(" ".join(line.split()) for line in lines if line.strip())
+    word_count = len(re.findall(r"\w+", text))
+    return {
+        "version": PREP_VERSION,
+        "html": "".join(parser.out),
+        "toc": parser.toc,
+        "word_count": word_count,
+        "reading_time": max(1, math.ceil(word_count / WORDS_PER_MINUTE)) if word_count else 0,
+        "text": text,
+    }
+
+
+def excerpt_from_text(text, limit=200):
+    """Cut plain text to ``limit`` characters on a word boundary."""
+    text = " ".join((text or "").split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0].rstrip(",.;:—-") + "…"
@@ -0,0 +1,242 @@
+"""
+Streaming backup and restore of the site data and uploaded files.
+
+An export is an uncompressed tar archive. Its first member is
+``manifest.json``::
+
+    {"format": 1, "created": "2026-10-19T12:00:00",
+     "files": [{"path": "data/articles.json", "size": 5120, "sha256": "..."},
+               {"path": "static/uploads/articles/1.jpg", ...}]}
+
+The data files and uploads follow, stored under the same paths relative to
+the project root. The archive is generated while it is sent. Each file is
+read in ``CHUNK_SIZE`` pieces, so memory use does not grow with the library.
+Checksums of uploads are cached by (mtime, size), and uploads never change
+in place, so repeat exports read each image only once.
+
+An import reads the archive as a stream. Uploads that already exist with the
+same checksum are skipped. Everything else is staged and checked against the
+manifest. Nothing is written until every file has been verified.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+FORMAT = 1
+MANIFEST = "manifest.json"
+CHUNK_SIZE = 64 * 1024
+BLOCK = tarfile.BLOCKSIZE
+MAX_DATA_FILE = 16 * 1024 * 1024   # JSON files are staged in memory
+UPLOADS_PREFIX = "static/uploads/"
+DATA_PATH_RE = re.compile(r"^data/(?:content/|articles/)?[\w-]+\.json$")
+HASH_CACHE_LIMIT = 4096   # checksums kept, least recently used dropped first
+
+_hash_cache = OrderedDict()   # path -> (mtime_ns, size, sha256)
+_hash_lock = threading.Lock()
+
+
+class BackupError(Exception):
+    """The archive is malformed or does not match its manifest."""
+
+
+def file_sha256(path):
+    """Checksum of a file, cached by mtime and size."""
+    st = os.stat(path)
+    with _hash_lock:
+        cached = _hash_cache.get(path)
+        if cached:
+            _hash_cache.move_to_end(path)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    with _hash_lock:
+        _hash_cache[path] = (st.st_mtime_ns, st.st_size, digest.hexdigest())
+        while len(_hash_cache) > HASH_CACHE_LIMIT:
+            _hash_cache.popitem(last=False)
+    return digest.hexdigest()
+
+
+# ─── Export ────────────────────────────────────────────────────
+
+def collect(root, data, uploads):
+    """Archive entries: ``data`` maps relative paths to JSON values, ``uploads`` are relative paths."""
+    entries = []
+    for rel, value in data.items():
+        body = json.dumps(value, ensure_ascii=False, indent=4).encode("utf-8")
+        entries.append({"path": rel, "size": len(body), "sha256": hashlib.sha256(body).hexdigest(),
+                        "body": body})
+    for rel in sorted(set(uploads)):
+        path = os.path.join(root, rel)
+        if os.path.isfile(path):
+            entries.append({"path": rel, "size": os.path.getsize(path), "sha256": file_sha256(path)})
+    return entries
+
+
+def _header(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def _padding(size):
+    return b"\0" * (-size % BLOCK)
+
+
+def stream_tar(root, entries):
+    """Yield the archive chunk by chunk: manifest first, then every entry."""
+    now = int(time.time())
+    manifest = json.dumps({
+        "format": FORMAT,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "files": [{k: e[k] for k in ("path", "size", "sha256")} for e in entries],
+    }, ensure_ascii=False, indent=2).encode("utf-8")
+    yield _header(MANIFEST, len(manifest), now) + manifest + _padding(len(manifest))
+    for entry in entries:
+        yield _header(entry["path"], entry["size"], now)
+        if "body" in entry:
+            yield entry["body"]
+        else:
+            remaining = entry["size"]
+            with open(os.path.join(root, entry["path"]), "rb") as f:
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise BackupError(f"{entry['path']} изменился во время экспорта")
+                    remaining -= len(chunk)
+                    yield chunk
+        yield _padding(entry["size"])
+    yield b"\0" * (2 * BLOCK)
+
+
+# ─── Import ────────────────────────────────────────────────────
+
+def _check_path(rel):
+    norm = posixpath.normpath(rel)
+    if norm != rel or rel.startswith("/") or ".." in rel.split("/"):
+        raise BackupError(f"Недопустимый путь в архиве: {rel}")
+    if DATA_PATH_RE.match(rel):
+        return "data"
+    if rel.startswith(UPLOADS_PREFIX) and not rel.rsplit("/", 1)[-1].startswith("."):
+        return "upload"
+    raise BackupError(f"Недопустимый путь в архиве: {rel}")
+
+
+def read_archive(fileobj, root):
+    """Read and verify an archive without touching the live files.
+
+    Returns ``(data, staged, skipped, staging_dir)``. ``data`` maps paths to
+    JSON values, ``staged`` maps upload paths to verified temp files inside
+    ``staging_dir``, and ``skipped`` lists uploads that are already present.
+    The caller applies the result with ``restore_uploads`` and removes
+    ``staging_dir``.
+    """
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError as e:
+        raise BackupError(f"Не удалось прочитать архив: {e}")
+    uploads_dir = os.path.join(root, UPLOADS_PREFIX)
+    os.makedirs(uploads_dir, exist_ok=True)
+    # Staged next to the uploads so the final move is a rename on the same volume
+    staging_dir = tempfile.mkdtemp(prefix=".import-", dir=uploads_dir)
+    data, staged, skipped, seen = {}, {}, [], set()
+    try:
+        manifest = None
+        for member in archive:
+            if not member.isfile():
+                continue
+            if manifest is None:
+                if member.name != MANIFEST:
+                    raise BackupError("Первым файлом архива должен быть manifest.json")
+                manifest = _read_manifest(archive.extractfile(member))
+                continue
+            expected = manifest.get(member.name)
+            if expected is None:
+                raise BackupError(f"Файла {member.name} нет в манифесте")
+            kind = _check_path(member.name)
+            seen.add(member.name)
+            source = archive.extractfile(member)
+            if kind == "data":
+                if member.size > MAX_DATA_FILE:
+                    raise BackupError(f"{member.name} слишком большой")
+                body = source.read()
+                if hashlib.sha256(body).hexdigest() != expected["sha256"]:
+                    raise BackupError(f"Контрольная сумма не совпадает: {member.name}")
+                try:
+                    data[member.name] = json.loads(body.decode("utf-8"))
+                except ValueError:
+                    raise BackupError(f"{member.name} не является JSON")
+                continue
+            target = os.path.join(root, member.name)
+            if os.path.isfile(target) and file_sha256(target) == expected["sha256"]:
+                skipped.append(member.name)
+                continue  # the stream skips the unread member body
+            tmp = os.path.join(staging_dir, str(len(staged)))
+            digest = hashlib.sha256()
+            with open(tmp, "wb") as out:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+            if digest.hexdigest() != expected["sha256"]:
+                raise BackupError(f"Контрольная сумма не совпадает: {member.name}")
+            staged[member.name] = tmp
+        if manifest is None:
+            raise BackupError("Архив пуст")
+        missing = set(manifest) - seen
+        if missing:
+            raise BackupError(f"В архиве не хватает файлов: {', '.join(sorted(missing)[:5])}")
+    except (tarfile.TarError, OSError, EOFError) as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise BackupError(f"Архив повреждён: {e}")
+    except BackupError:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    return data, staged, skipped, staging_dir
+
+
+def _read_manifest(f):
+    try:
+        manifest = json.load(f)
+    except ValueError:
+        raise BackupError("manifest.json повреждён")
+    if manifest.get("format") != FORMAT:
+        raise BackupError("Неподдерживаемый формат архива")
+    return {e["path"]: e for e in manifest.get("files", [])}
+
+
+def restore_uploads(root, staged):
+    """Move verified uploads into place: all of them, or on error none.
+
+    Files that get replaced are kept aside until every move has succeeded.
+    """
+    moved = []   # (target, previous file kept aside or None)
+    try:
+        for rel, tmp in staged.items():
+            target = os.path.join(root, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            previous = None
+            if os.path.exists(target):
+                previous = tmp + ".prev"
+                os.link(target, previous)
+            os.replace(tmp, target)
+            moved.append((target, previous))
+    except OSError:
+        for target, previous in reversed(moved):
+            if previous:
+                os.replace(previous, target)
+            else:
+                os.remove(target)
+        raise
@@ -0,0 +1,96 @@
+"""
+Batch operations on a list of items (articles, announcements, documents).
+
+A batch is a list of operations::
+
+    [{"op": "publish", "id": "my-article"},
+     {"op": "unpublish", "id": "old-article"},
+     {"op": "delete", "id": "draft"},
+     {"op": "slug", "id": "my-article", "slug": "new-slug"},
+     {"op": "reorder", "order": ["new-slug", "old-article"]}]
+
+Items are identified by ``slug``; documents have no slug and are identified
+by their ``image`` path. ``apply`` runs all operations on a copy, in order,
+so later operations see earlier ones. If any operation is invalid nothing is
+changed and every error is reported, which lets the caller save the result
+with a single write.
+"""
+import copy
+import re
+from datetime import datetime
+
+OPERATIONS = {"publish", "unpublish", "delete", "slug", "reorder"}
+SLUG_RE = re.compile(r"^[a-z0-9]+(?:-[a-z0-9]+)*$")
+
+
+def _past(value, now):
+    try:
+        return bool(value) and datetime.fromisoformat(value) <= now
+    except ValueError:
+        return False
+
+
+def apply(items, ops, key="slug", allowed=OPERATIONS, now=None):
+    """Apply ``ops`` to a copy of ``items``.
+
+    Returns ``(new_items, removed, errors)``. ``removed`` holds the deleted
+    items (for image cleanup); on any error ``new_items`` is None. With
+    ``now``, publishing also drops an unpublish time that has already passed,
+    which would otherwise keep the item off the site.
+    """
+    items = copy.deepcopy(items)
+    removed, errors = [], []
+    if not isinstance(ops, list) or not ops:
+        return None, [], ["Пустой список операций"]
+
+    def find(item_id):
+        return next((i for i, it in enumerate(items) if it.get(key) == item_id), None)
+
+    for n, op in enumerate(ops, 1):
+        name = op.get("op") if isinstance(op, dict) else None
+        if name not in allowed:
+            errors.append(f"#{n}: неизвестная операция {name!r}")
+            continue
+        if name == "reorder":
+            order = op.get("order")
+            if (not isinstance(order, list) or not all(isinstance(i, (str, int)) for i in order)
+                    or len(set(order)) != len(order)):
+                errors.append(f"#{n}: порядок должен быть списком без повторов")
+                continue
+            unknown = [i for i in order if find(i) is None]
+            if unknown:
+                errors.append(f"#{n}: не найдены {', '.join(map(str, unknown))}")
+                continue
+            # Listed items first, in the given order; the rest keep their order
+            position = {item_id: p for p, item_id in enumerate(order)}
+            items.sort(key=lambda it: position.get(it.get(key), len(position)))
+            continue
+
+        idx = find(op.get("id"))
+        if idx is None:
+            errors.append(f"#{n}: не найден {op.get('id')!r}")
+            continue
+        item = items[idx]
+        if name == "publish":
+            item["published"] = True
+            item["publish_at"] = ""
+            if now and _past(item.get("unpublish_at"), now):
+                item["unpublish_at"] = ""
+        elif name == "unpublish":
+            item["published"] = False
+            item["publish_at"] = ""
+            item["unpublish_at"] = ""
+        elif name == "delete":
+            removed.append(items.pop(idx))
+        elif name == "slug":
+            new_slug = str(op.get("slug", "")).strip()
+            if not SLUG_RE.match(new_slug):
+                errors.append(f"#{n}: недопустимый slug {new_slug!r}")
+            elif new_slug != item[key] and find(new_slug) is not None:
+                errors.append(f"#{n}: slug {new_slug!r} уже занят")
+            else:
+                item[key] = new_slug
+
+    if errors:
+        return None, [], errors
+    return items, removed, []
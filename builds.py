@@ -0,0 +1,86 @@
+"""
+Build directories of a site.
+
+Every build is frozen into a fresh ``builds/<id>/``. ``build`` is a symlink
+that is switched to it atomically once the build is complete, so anything
+reading ``build/`` sees either the old site or the new one, never a mix. The
+last ``KEEP_BUILDS`` builds stay on disk; going back to one of them is one
+switch of the link.
+"""
+import os
+import shutil
+from datetime import datetime
+
+KEEP_BUILDS = 5
+
+
+def new_build(builds_dir):
+    """Create an empty directory for the next build and return its path."""
+    os.makedirs(builds_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    n = 0
+    while True:
+        path = os.path.join(builds_dir, stamp if n == 0 else f"{stamp}-{n}")
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            n += 1
+
+
+def current(link):
+    """Build directory ``link`` points to, or None."""
+    return os.path.realpath(link) if os.path.islink(link) else None
+
+
+def switch(link, target):
+    """Point ``link`` at ``target`` in one rename."""
+    tmp = f"{link}.tmp{os.getpid()}"
+    os.symlink(os.path.relpath(target, os.path.dirname(link)), tmp)
+    os.replace(tmp, link)
+
+
+def adopt(link, builds_dir):
+    """Move a plain build directory left by older versions under ``builds_dir``."""
+    if os.path.isdir(link) and not os.path.islink(link):
+        target = new_build(builds_dir)
+        os.rmdir(target)
+        os.rename(link, target)
+        switch(link, target)
+
+
+def clone(source, dest):
+    """Copy a finished build as the base of an incremental one.
+
+    Pages and the service worker are rewritten in place after freezing, so
+    they are copied. Files under static/ are never rewritten and are hardlinked.
+    """
+    for dirpath, _, filenames in os.walk(source):
+        rel = os.path.relpath(dirpath, source)
+        os.makedirs(os.path.join(dest, rel), exist_ok=True)
+        link = rel.split(os.sep)[0] == "static"
+        for name in filenames:
+            src, dst = os.path.join(dirpath, name), os.path.join(dest, rel, name)
+            try:
+                if not link:
+                    raise OSError
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+
+def history(builds_dir):
+    """Build ids, oldest first."""
+    if not os.path.isdir(builds_dir):
+        return []
+    return sorted(name for name in os.listdir(builds_dir)
+                  if os.path.isdir(os.path.join(builds_dir, name)))
+
+
+def prune(builds_dir, link, keep=KEEP_BUILDS):
+    """Remove all but the last ``keep`` builds; the current one always stays."""
+    active = current(link)
+    for name in history(builds_dir)[:-keep]:
+        path = os.path.join(builds_dir, name)
+        if os.path.realpath(path) != active:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,188 @@
+"""
+Build-time critical CSS for the frozen site.
+
+For every built page we collect the tags, classes and ids used above the
+fold (the header, mobile menu and the first sections of <main>), keep only
+the style.css rules that can match them and inline those into <head>. The
+full stylesheet is then loaded asynchronously, with a <noscript> fallback.
+"""
+import os
+import re
+from html.parser import HTMLParser
+
+FOLD_SECTIONS = 2          # top-level elements of <main> treated as above the fold
+MARKER = "data-critical"   # set on the inlined <style>, makes the pass idempotent
+
+STYLESHEET_RE = re.compile(r'<link rel="stylesheet" href="([^"]*css/style\.css)">')
+JS_CLASS_RE = re.compile(r"""classList\.(?:add|toggle)\(\s*['"]([\w-]+)['"]|className\s*=\s*['"]([\w\s-]+)['"]""")
+PSEUDO_RE = re.compile(r"::?[\w-]+(\((?:[^()]|\([^()]*\))*\))?")
+ATTR_RE = re.compile(r"\[[^\]]*\]")
+CLASS_RE = re.compile(r"\.([\w-]+)")
+ID_RE = re.compile(r"#([\w-]+)")
+TAG_RE = re.compile(r"(?:^|[\s>+~])([a-zA-Z][\w-]*)")
+COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+
+
+# ─── HTML: what is above the fold ──────────────────────────────
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+             "meta", "source", "track", "wbr"}
+
+
+class _FoldCollector(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.tags, self.classes, self.ids = {"html", "body"}, set(), set()
+        self.in_body = False
+        self.main_depth = None   # depth of <main> once entered
+        self.depth = 0
+        self.sections_seen = 0
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "html":
+            self._collect(tag, attrs)
+        if tag == "body":
+            self.in_body = True
+        if self.done or not self.in_body:
+            return
+        if tag in VOID_TAGS:
+            self._collect(tag, attrs)
+            return
+        self.depth += 1
+        if self.main_depth is not None and self.depth == self.main_depth + 1:
+            self.sections_seen += 1
+            if self.sections_seen > FOLD_SECTIONS:
+                self.done = True
+                return
+        if tag == "main":
+            self.main_depth = self.depth
+        self._collect(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.in_body and not self.done:
+            self._collect(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if self.in_body and not self.done and tag not in VOID_TAGS:
+            self.depth -= 1
+
+    def _collect(self, tag, attrs):
+        self.tags.add(tag)
+        for name, value in attrs:
+            if name == "class" and value:
+                self.classes.update(value.split())
+            elif name == "id" and value:
+                self.ids.add(value)
+
+
+def above_fold(html):
+    collector = _FoldCollector()
+    collector.feed(html)
+    return collector.tags, collector.classes, collector.ids
+
+
+def script_classes(js):
+    """Classes main.js adds at runtime (header--scrolled, fade-in--visible, ...)."""
+    classes = set()
+    for added, assigned in JS_CLASS_RE.findall(js):
+        classes.update((added or assigned).split())
+    return classes
+
+
+# ─── CSS: parse and filter ─────────────────────────────────────
+
+def parse_css(css):
+    """Split CSS into a list of (prelude, body) pairs; at-rule bodies stay raw."""
+    css = COMMENT_RE.sub("", css)
+    rules, i, n = [], 0, len(css)
+    while i < n:
+        brace = css.find("{", i)
+        semi = css.find(";", i)
+        if brace == -1:
+            break
+        if semi != -1 and semi < brace:  # @import / @charset
+            rules.append((css[i:semi].strip(), None))
+            i = semi + 1
+            continue
+        prelude = css[i:brace].strip()
+        depth, j = 1, brace + 1
+        while j < n and depth:
+            if css[j] == "{":
+                depth += 1
+            elif css[j] == "}":
+                depth -= 1
+            j += 1
+        rules.append((prelude, css[brace + 1:j - 1].strip()))
+        i = j
+    return rules
+
+
+def _selector_matches(selector, tags, classes, ids):
+    simple = ATTR_RE.sub("", PSEUDO_RE.sub("", selector)).strip()
+    if not simple or simple == "*":
+        return True
+    return (set(CLASS_RE.findall(simple)) <= classes
+            and set(ID_RE.findall(simple)) <= ids
+            and {t.lower() for t in TAG_RE.findall(ID_RE.sub("", CLASS_RE.sub("", simple)))} <= tags)
+
+
+def filter_rules(rules, tags, classes, ids):
+    out = []
+    for prelude, body in rules:
+        if body is None:
+            out.append(prelude + ";")
+        elif prelude.startswith(("@media", "@supports")):
+            inner = filter_rules(parse_css(body), tags, classes, ids)
+            if inner:
+                out.append(prelude + "{" + "".join(inner) + "}")
+        elif prelude.startswith("@font-face"):
+            out.append(prelude + "{" + body + "}")
+        elif prelude.startswith("@"):
+            continue  # @keyframes etc. arrive with the full stylesheet
+        else:
+            kept = [s.strip() for s in prelude.split(",") if _selector_matches(s, tags, classes, ids)]
+            if kept:
+                out.append(",".join(kept) + "{" + " ".join(body.split()) + "}")
+    return out
+
+
+def critical_css(html, rules, extra_classes=()):
+    tags, classes, ids = above_fold(html)
+    return "".join(filter_rules(rules, tags, classes | set(extra_classes), ids))
+
+
+# ─── Build step ────────────────────────────────────────────────
+
+def inline_critical_css(build_dir, css_path, js_path=None):
+    """Inline critical CSS into every built page. Returns {page: (critical, full) bytes}."""
+    with open(css_path, "r", encoding="utf-8") as f:
+        full_css = f.read()
+    rules = parse_css(full_css)
+    extra = set()
+    if js_path and os.path.exists(js_path):
+        with open(js_path, "r", encoding="utf-8") as f:
+            extra = script_classes(f.read())
+    report = {}
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            if not name.endswith(".html"):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "r", encoding="utf-8") as f:
+                html = f.read()
+            match = STYLESHEET_RE.search(html)
+            if MARKER in html or not match:
+                continue
+            css = critical_css(html, rules, extra)
+            href = match.group(1)
+            replacement = (
+                f"<style {MARKER}>{css}</style>\n"
+                f'    <link rel="preload" href="{href}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">\n'
+                f'    <noscript><link rel="stylesheet" href="{href}"></noscript>'
+            )
+            html = html[:match.start()] + replacement + html[match.end():]
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(html)
+            report[os.path.relpath(path, build_dir)] = (len(css.encode("utf-8")), len(full_css.encode("utf-8")))
+    return report
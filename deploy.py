@@ -0,0 +1,131 @@
+"""
+Per-tenant build & deploy queue.
+
+Each tenant owns one ``DeployQueue``. Jobs run one at a time in a background
+thread. Jobs that are still waiting are merged: their page lists are united,
+and a full build absorbs everything. A burst of saves and scheduled
+publications therefore ends in one build.
+
+The app runs in several gunicorn workers, so the waiting job, the log and
+the result live in a state file shared by all of them (guarded by its own
+short lock). A file lock held for the whole build keeps the workers from
+building the same site at the same time; whichever worker gets it takes
+the merged waiting job.
+"""
+import fcntl
+import json
+import threading
+
+import journal
+
+IDLE = {"pending": None, "running": False, "log": [], "result": None}
+
+
+class _Log(list):
+    """Build log that is written to the state file as it grows."""
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+
+    def append(self, line):
+        super().append(line)
+        self.queue._update(log=list(self))
+
+
+class DeployQueue:
+    def __init__(self, runner, lock_path, state_path):
+        """``runner(only_urls, message, log)`` builds and pushes, returning "success" or "error"."""
+        self.runner = runner
+        self.lock_path = lock_path    # held for the whole build
+        self.state_path = state_path  # waiting job, log and result of the last build
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # ─── Shared state ───
+
+    def _read(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return {**IDLE, **json.load(f)}
+        except (OSError, ValueError):
+            return dict(IDLE)
+
+    def _update(self, **changes):
+        with journal.locked(self.state_path):
+            state = {**self._read(), **changes}
+            journal.write_snapshot(self.state_path, state)
+        return state
+
+    def _build_running(self):
+        """True while some worker holds the build lock."""
+        with open(self.lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            return False
+
+    # ─── API ───
+
+    def submit(self, only_urls=None, message=None):
+        """Queue a build; returns False if it was merged into a waiting one."""
+        with journal.locked(self.state_path):
+            state = self._read()
+            job = state["pending"]
+            fresh = job is None
+            if fresh:
+                job = {"only_urls": sorted(set(only_urls)) if only_urls else None, "message": message}
+            else:
+                if job["only_urls"] is None or not only_urls:
+                    job["only_urls"] = None
+                else:
+                    job["only_urls"] = sorted(set(job["only_urls"]) | set(only_urls))
+                if job["message"] != message:
+                    job["message"] = None
+            state["pending"] = job
+            journal.write_snapshot(self.state_path, state)
+        self._start()
+        return fresh
+
+    def busy(self):
+        state = self._read()
+        return state["pending"] is not None or (state["running"] and self._build_running())
+
+    def status(self):
+        state = self._read()
+        # A worker that died mid-build leaves "running" behind; the free lock tells
+        running = state["running"] and self._build_running()
+        if state["pending"] is not None and not running:
+            self._start()  # a job left by another worker that is gone
+        # A submitted job counts as running until a worker thread picks it up
+        return {"running": running or state["pending"] is not None, "queued": state["pending"] is not None,
+                "log": state["log"], "result": state["result"]}
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            with open(self.lock_path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # wait for a build in another worker
+                with journal.locked(self.state_path):
+                    state = self._read()
+                    job = state["pending"]
+                    if job is None:
+                        with self.lock:
+                            self.thread = None
+                        return
+                    journal.write_snapshot(self.state_path, {"pending": None, "running": True,
+                                                             "log": [], "result": None})
+                log = _Log(self)
+                try:
+                    result = self.runner(job["only_urls"], job["message"], log)
+                except Exception as e:
+                    log.append(f"❌ Ошибка: {e}")
+                    result = "error"
+                self._update(running=False, result=result)
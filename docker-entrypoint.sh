@@ -2,14 +2,20 @@
 set -e
 
 # ── Seed empty volumes with default data (first run) ──────────
-if [ ! -f /app/data/content.json ]; then
+# (content.json — старый формат, при запуске приложение разбивает его на data/content/*.json)
+if [ ! -d /app/data/content ] && [ ! -f /app/data/content.json ]; then
     echo "[init] Копирую данные по умолчанию в /app/data/ ..."
     cp -r /defaults-data/* /app/data/
 fi
 
 if [ ! -d /app/static/uploads/pages ]; then
     echo "[init] Создаю структуру /app/static/uploads/ ..."
-    cp -r /defaults-uploads/uploads/* /app/static/uploads/
+    cp -r /defaults-uploads/uploads/. /app/static/uploads/
+fi
+
+# Файлы, которых нет в static/uploads/, но есть в хранилище (data/objects/)
+if [ -f /app/data/uploads.json ]; then
+    SCHEDULER_ENABLED=0 python -m flask --app app uploads-restore || true
 fi
 # ──────────────────────────────────────────────────────────────
 
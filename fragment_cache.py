@@ -0,0 +1,98 @@
+"""
+Cache of rendered template fragments.
+
+A Jinja extension adds a ``cache`` tag::
+
+    {% cache "header", data_version("site"), request.endpoint, url_for("index") %}
+        ...
+    {% endcache %}
+
+The first argument names the fragment. The others are the exact inputs the
+fragment depends on. The body is rendered once per distinct key; later
+renders reuse the markup. Everything the fragment uses must appear in the
+key. Frozen pages use relative URLs, which depend on the page that links, so
+a fragment with links is keyed on ``request.endpoint`` and
+``url_for("index")``. Pages of one endpoint at the same depth, such as all
+the articles, then share the fragment.
+
+Entries are kept per scope (one scope per site) in a bounded LRU. The app
+clears a scope whenever it saves data, and keys carry data versions, so
+edits made outside the admin are picked up too. Hits and misses are counted
+per fragment name.
+"""
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+CACHE_LIMIT = 256   # fragments per scope
+
+
+class FragmentCache:
+    def __init__(self, limit=CACHE_LIMIT):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.entries = {}   # scope -> OrderedDict(key -> markup)
+        self.stats = {}     # name -> {"hits": n, "misses": n}
+
+    def get(self, scope, key):
+        with self.lock:
+            entries = self.entries.get(scope)
+            markup = entries.get(key) if entries else None
+            if markup is not None:
+                entries.move_to_end(key)
+            counts = self.stats.setdefault(key[0], {"hits": 0, "misses": 0})
+            counts["hits" if markup is not None else "misses"] += 1
+            return markup
+
+    def put(self, scope, key, markup):
+        with self.lock:
+            entries = self.entries.setdefault(scope, OrderedDict())
+            entries[key] = markup
+            while len(entries) > self.limit:
+                entries.popitem(last=False)
+
+    def clear(self, scope=None):
+        """Drop the fragments of one scope, or of all of them."""
+        with self.lock:
+            if scope is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(scope, None)
+
+    def report(self):
+        """Per-fragment hit/miss counts and the number of cached entries."""
+        with self.lock:
+            rows = [{"name": name, **counts,
+                     "ratio": counts["hits"] / ((counts["hits"] + counts["misses"]) or 1)}
+                    for name, counts in sorted(self.stats.items())]
+            return {"fragments": rows, "entries": sum(len(e) for e in self.entries.values())}
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache name, key... %}body{% endcache %}``; see the module docstring."""
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache(), fragment_cache_scope=lambda: None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_render", [nodes.Tuple(args, "load")])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        scope = self.environment.fragment_cache_scope()
+        markup = cache.get(scope, key)
+        if markup is None:
+            markup = Markup(caller())
+            cache.put(scope, key, markup)
+        return markup
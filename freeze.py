@@ -2,17 +2,43 @@
 Генерация статических файлов для GitHub Pages.
 Запуск: python freeze.py
 Результат будет в папке build/
+
+Каждая сборка идёт в новую папку builds/<id>/ из снимка данных, а build/ —
+ссылка на последнюю готовую сборку (см. builds.py).
+
+Инкрементальная сборка (пересобрать только указанные страницы):
+    python freeze.py --only / /articles/ /articles/<slug>/
+
+При нескольких сайтах (TENANTS_FILE) сайт выбирается ключом, результат
+попадает в build/ его каталога:
+    python freeze.py --tenant mironova
+
+Загруженные файлы берутся из хранилища по манифесту data/uploads.json
+(см. upload_store.py); без манифеста — из static/uploads/.
 """
+import argparse
+import os
 import shutil
 import warnings
+from flask import url_for
 from flask_frozen import Freezer
-from app import app, get_articles
+import builds
+import tenants
+import upload_store
+from app import app, find_tenant, get_articles, is_live, snapshot_data
+from critical_css import inline_critical_css
+from service_worker import write_service_worker
 
 warnings.filterwarnings("ignore", "Nothing frozen for endpoints")
 
 app.config["FREEZER_DESTINATION"] = "build"
 app.config["FREEZER_RELATIVE_URLS"] = True
 app.config["FREEZER_IGNORE_MIMETYPE_WARNINGS"] = True
+app.config["SCHEDULER_ENABLED"] = False
+app.config["SERVICE_WORKER"] = True
+
+# Pages precached by the service worker; articles are cached on first visit
+PRECACHE_PAGES = ("index", "about", "services", "articles", "documents", "announcements", "contact")
 
 freezer = Freezer(app, with_no_argument_rules=False)
 
@@ -62,17 +88,101 @@ def announcements():
     yield {}
 
 
+def uploads():
+    """Uploads of the site: those in the manifest, or everything in static/uploads/."""
+    tenant = find_tenant()
+    manifest = upload_store.load_manifest(tenant.uploads_file)
+    if manifest is not None:
+        paths = list(manifest)
+    else:
+        paths = [os.path.relpath(os.path.join(dirpath, name), tenant.static_dir).replace(os.sep, "/")
+                 for dirpath, _, filenames in os.walk(tenant.upload_folder)
+                 for name in filenames if not name.startswith(".")]
+    for rel in paths:
+        yield "static", {"filename": rel}
+
+
 @freezer.register_generator
 def article():
     """Генерирует URL для каждой опубликованной статьи."""
     for art in get_articles():
-        if art.get("published"):
+        if is_live(art):
             yield {"slug": art["slug"]}
 
 
-if __name__ == "__main__":
-    freezer.freeze()
+def build(tenant, build_dir, only=None):
+    """Freeze the site of ``tenant`` (normally a snapshot view) into ``build_dir``."""
+    app.config["FREEZER_DESTINATION"] = build_dir
+    # Uploads come from the site, not from the app's static folder
+    app.config["FREEZER_STATIC_IGNORE"] = ["uploads/"]
+    freezer.register_generator(uploads)
+    manifest = upload_store.load_manifest(tenant.uploads_file)
+    if manifest is not None:
+        # Link the stored files in place; the freezer then leaves them alone
+        missing = upload_store.materialize(tenant.store_dir, manifest, os.path.join(build_dir, "static"),
+                                           fallback_dir=tenant.static_dir)
+        for rel in missing:
+            print(f"   ⚠️ нет в хранилище: {rel}")
+    only = set(only or ())
+
+    def skip(url, path):
+        if manifest is not None and url.startswith("/static/uploads/"):
+            return True
+        return bool(only) and url not in only
+
+    app.config["FREEZER_SKIP_EXISTING"] = skip
+    with tenants.activate(tenant):
+        freezer.freeze()
+        with app.test_request_context():
+            pages = [url_for(endpoint) for endpoint in PRECACHE_PAGES]
     # Remove admin pages from build if accidentally generated
-    admin_dir = "build/admin"
+    admin_dir = os.path.join(build_dir, "admin")
     shutil.rmtree(admin_dir, ignore_errors=True)
-    print("✅ Сайт успешно собран в папку build/")
+    # Inline above-the-fold CSS, load style.css asynchronously
+    report = inline_critical_css(
+        build_dir,
+        os.path.join(app.static_folder, "css", "style.css"),
+        os.path.join(app.static_folder, "js", "main.js"),
+    )
+    for page, (critical, full) in sorted(report.items()):
+        print(f"   critical CSS {critical / 1024:5.1f} KB из {full / 1024:.1f} KB — {page}")
+    # Service worker with a manifest of the current asset and page revisions
+    manifest = write_service_worker(build_dir, app.jinja_env.get_template("sw.js"), pages)
+    print(f"   service worker {manifest['version']}: {len(manifest['precache'])} файлов в кэше")
+    fragments = app.jinja_env.fragment_cache.report()["fragments"]
+    hits = sum(f["hits"] for f in fragments)
+    print(f"   кэш фрагментов: {hits} попаданий из {hits + sum(f['misses'] for f in fragments)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", metavar="URL",
+                        help="пересобрать только эти страницы, остальные оставить как есть")
+    parser.add_argument("--tenant", metavar="KEY", help="какой сайт собирать (по умолчанию единственный)")
+    args = parser.parse_args()
+    tenant = tenants.get(args.tenant) if args.tenant else tenants.single()
+    if tenant is None:
+        parser.error("укажите сайт: --tenant " + " | ".join(t.key for t in tenants.all_tenants()))
+    app.config["TENANT"] = tenant.key
+    # Each build goes to a fresh builds/<id>/ from a snapshot of the data;
+    # build/ is switched to it only when it is complete
+    builds.adopt(tenant.build_dir, tenant.builds_dir)
+    previous = builds.current(tenant.build_dir)
+    build_dir = builds.new_build(tenant.builds_dir)
+    snapshot_dir = os.path.join(tenant.snapshots_dir, os.path.basename(build_dir))
+    try:
+        with tenants.activate(tenant):
+            view = snapshot_data(snapshot_dir)
+        if args.only and previous:
+            builds.clone(previous, build_dir)
+        build(view, build_dir, args.only)
+        builds.switch(tenant.build_dir, build_dir)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    builds.prune(tenant.builds_dir, tenant.build_dir)
+    shown = os.path.relpath(build_dir)
+    print(f"✅ Сайт успешно собран в папку {build_dir if shown.startswith('..') else shown}/"
+          f" (build/ указывает на неё)")
@@ -0,0 +1,102 @@
+"""
+Intrinsic dimensions and low-quality placeholders for uploaded images.
+
+Metadata is kept in one JSON file keyed by the path relative to static/
+(``uploads/pages/photo.jpg``)::
+
+    {"width": 853, "height": 1280, "color": "#8a7a6b",
+     "placeholder": "data:image/jpeg;base64,..."}
+
+Templates use it to emit width/height (no layout shift) and a tiny blurred
+preview that is shown until the real file arrives.
+"""
+import base64
+import io
+import os
+
+from PIL import ExifTags, Image, ImageFilter, ImageOps, UnidentifiedImageError
+
+import journal
+
+PLACEHOLDER_SIZE = 16    # longest side of the LQIP, px
+PLACEHOLDER_QUALITY = 40
+ROTATED = {5, 6, 7, 8}   # EXIF orientations that swap width and height
+
+
+def size(path):
+    """Displayed (width, height) of an image, EXIF orientation applied; None if unreadable."""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            if img.getexif().get(ExifTags.Base.Orientation) in ROTATED:
+                width, height = height, width
+    except (OSError, UnidentifiedImageError):
+        return None
+    return width, height
+
+
+def extract(path):
+    """Return metadata for one image file, or None for SVG / unreadable files."""
+    try:
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)  # phone photos are stored sideways
+            width, height = img.size
+            img = img.convert("RGB")
+            color = img.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+            thumb = img.copy()
+            thumb.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            thumb = thumb.filter(ImageFilter.GaussianBlur(1))
+            buf = io.BytesIO()
+            thumb.save(buf, "JPEG", quality=PLACEHOLDER_QUALITY, optimize=True)
+    except (OSError, UnidentifiedImageError):
+        return None
+    return {
+        "width": width,
+        "height": height,
+        "color": "#{:02x}{:02x}{:02x}".format(*color),
+        "placeholder": "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii"),
+    }
+
+
+def load(meta_file):
+    """Read-only view of all image metadata."""
+    if not os.path.exists(meta_file):
+        return {}
+    return journal.view(meta_file)
+
+
+def update(meta_file, static_folder, rel_paths, force=False, prune=False):
+    """Compute metadata for ``rel_paths`` that lack it (all of them with ``force``).
+
+    With ``prune`` entries not in ``rel_paths`` are dropped (backfill).
+    Returns the number of images processed.
+    """
+    rel_paths = [p for p in rel_paths if p]
+    if not os.path.exists(meta_file):
+        journal.write_snapshot(meta_file, {})
+    with journal.locked(meta_file):
+        meta = journal.load(meta_file)
+        done = 0
+        for rel in rel_paths:
+            full = os.path.join(static_folder, rel)
+            if (rel in meta and not force) or not os.path.isfile(full):
+                continue
+            info = extract(full)
+            if info:
+                meta[rel] = info
+                done += 1
+        if prune:
+            wanted = set(rel_paths)
+            meta = {k: v for k, v in meta.items() if k in wanted}
+        journal.write_snapshot(meta_file, meta)
+    return done
+
+
+def forget(meta_file, rel_paths):
+    """Drop metadata of deleted images."""
+    if not os.path.exists(meta_file):
+        return
+    with journal.locked(meta_file):
+        meta = journal.load(meta_file)
+        if any(rel in meta for rel in rel_paths):
+            journal.write_snapshot(meta_file, {k: v for k, v in meta.items() if k not in rel_paths})
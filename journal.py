@@ -0,0 +1,470 @@
+"""
+Append-only journal for the JSON data files.
+
+Each data file ``X.json`` is a snapshot. Saves do not rewrite it; instead
+the difference against the current state is appended as one line to
+``X.json.journal``::
+
+    {"rev": 12, "ts": "2026-10-19T12:00:00", "changes": [
+        {"p": ["contact_page", "cta", "title"], "o": "old", "n": "new"}]}
+
+A change without ``"o"`` created the value, one without ``"n"`` removed it.
+Lists of items with a ``slug`` are addressed by ``{"slug": ...}`` path
+segments plus an ``"#order"`` record, so history of one article survives
+reordering of the others.
+
+Compaction folds the journal into a fresh snapshot and moves the records to
+``X.json.history``, which keeps the last ``HISTORY_LIMIT`` revisions for
+listing and reverting.
+"""
+import copy
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+COMPACT_AFTER_BYTES = 256 * 1024
+COMPACT_AFTER_RECORDS = 200
+HISTORY_LIMIT = 500
+ORDER = "#order"
+CACHE_LIMIT = 64   # cached files per cache group, least recently used dropped first
+TAIL_CHUNK = 8192  # bytes read at a time from the end of a history file
+_REV_RE = re.compile(rb'^\{"rev":(\d+),')
+
+_cache = {}         # group -> OrderedDict(path -> (stamp, state, last_rev))
+_cache_groups = {}  # directory -> limit; files below it share one bounded cache
+_cache_lock = threading.Lock()
+
+
+# ─── Files & locking ────────────────────────────────────────────
+
+def _journal_path(path):
+    return path + ".journal"
+
+
+def _history_path(path):
+    return path + ".history"
+
+
+@contextmanager
+def locked(path, shared=False):
+    """Lock shared by all worker processes for one data file; exclusive unless ``shared``."""
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# ─── State cache ────────────────────────────────────────────────
+
+def set_cache_limit(directory, limit=CACHE_LIMIT):
+    """Give the files below ``directory`` (one tenant's data) their own bounded cache."""
+    with _cache_lock:
+        _cache_groups[os.path.abspath(directory)] = limit
+
+
+def _group(path):
+    """Innermost registered directory containing ``path``."""
+    path = os.path.abspath(path)
+    found = ""
+    for directory in _cache_groups:
+        if path.startswith(directory + os.sep) and len(directory) > len(found):
+            found = directory
+    return found
+
+
+def _cache_get(path):
+    group = _cache.get(_group(path))
+    entry = group.get(path) if group else None
+    if entry:
+        group.move_to_end(path)
+    return entry
+
+
+def _cache_put(path, entry):
+    name = _group(path)
+    group = _cache.setdefault(name, OrderedDict())
+    group[path] = entry
+    group.move_to_end(path)
+    while len(group) > _cache_groups.get(name, CACHE_LIMIT):
+        group.popitem(last=False)
+
+
+def _cache_drop(path):
+    group = _cache.get(_group(path))
+    if group:
+        group.pop(path, None)
+
+
+def _stamp(path):
+    st = os.stat(path)
+    try:
+        jsize = os.path.getsize(_journal_path(path))
+    except OSError:
+        jsize = 0
+    return st.st_mtime_ns, st.st_size, jsize
+
+
+def _read_records(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _last_rev(path):
+    """Revision of the last record in ``path``, reading only the end of the file.
+
+    History files hold hundreds of records with whole article bodies; this
+    is on the read path of every worker, so they are not parsed.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    with f:
+        pos, tail = f.seek(0, os.SEEK_END), b""
+        while pos > 0:
+            step = min(TAIL_CHUNK, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            lines = tail.rstrip(b"\n").rsplit(b"\n", 1)
+            if len(lines) == 2 or (pos == 0 and lines[0]):
+                match = _REV_RE.match(lines[-1])
+                return int(match.group(1)) if match else json.loads(lines[-1])["rev"]
+    return 0
+
+
+def write_snapshot(path, data):
+    """Atomically replace a JSON file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp, path)
+
+
+def _append(path, record):
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+# ─── Diff & apply ───────────────────────────────────────────────
+
+def _keyed(items):
+    """Return {slug: item} if every item is a dict with a unique slug."""
+    if not all(isinstance(i, dict) and "slug" in i for i in items):
+        return None
+    keyed = {i["slug"]: i for i in items}
+    return keyed if len(keyed) == len(items) else None
+
+
+def diff(old, new, path=()):
+    """List of change records turning ``old`` into ``new``."""
+    if old == new:
+        return []
+    path = list(path)
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in old:
+            if key not in new:
+                changes.append({"p": path + [key], "o": old[key]})
+            else:
+                changes += diff(old[key], new[key], path + [key])
+        for key in new:
+            if key not in old:
+                changes.append({"p": path + [key], "n": new[key]})
+        return changes
+    if isinstance(old, list) and isinstance(new, list):
+        old_keyed, new_keyed = _keyed(old), _keyed(new)
+        if old_keyed is not None and new_keyed is not None and (old or new):
+            changes = []
+            for slug, item in old_keyed.items():
+                seg = {"slug": slug}
+                if slug not in new_keyed:
+                    changes.append({"p": path + [seg], "o": item})
+                else:
+                    changes += diff(item, new_keyed[slug], path + [seg])
+            for slug, item in new_keyed.items():
+                if slug not in old_keyed:
+                    changes.append({"p": path + [{"slug": slug}], "n": item})
+            old_order, new_order = list(old_keyed), list(new_keyed)
+            if old_order != new_order:
+                changes.append({"p": path + [ORDER], "o": old_order, "n": new_order})
+            return changes
+        if len(old) == len(new):
+            changes = []
+            for i, (a, b) in enumerate(zip(old, new)):
+                changes += diff(a, b, path + [i])
+            return changes
+    return [{"p": path, "o": old, "n": new}]
+
+
+def _child(container, seg):
+    if isinstance(seg, dict):
+        return next((i for i in container if isinstance(i, dict) and i.get("slug") == seg["slug"]), None)
+    if isinstance(container, list):
+        return container[seg] if isinstance(seg, int) and seg < len(container) else None
+    return container.get(seg)
+
+
+def _apply_one(state, change):
+    path = change["p"]
+    if not path:
+        return copy.deepcopy(change["n"]) if "n" in change else state
+    parent = state
+    for seg in path[:-1]:
+        parent = _child(parent, seg) if parent is not None else None
+    if parent is None:
+        return state  # target no longer exists
+    last = path[-1]
+    if last == ORDER:
+        position = {slug: i for i, slug in enumerate(change.get("n") or [])}
+        parent.sort(key=lambda i: position.get(i.get("slug"), len(position)))
+    elif isinstance(last, dict):
+        idx = next((i for i, it in enumerate(parent) if it.get("slug") == last["slug"]), None)
+        if "n" not in change:
+            if idx is not None:
+                parent.pop(idx)
+        elif idx is None:
+            parent.append(copy.deepcopy(change["n"]))
+        else:
+            parent[idx] = copy.deepcopy(change["n"])
+    elif isinstance(parent, list):
+        if isinstance(last, int) and last < len(parent) and "n" in change:
+            parent[last] = copy.deepcopy(change["n"])
+    elif "n" in change:
+        parent[last] = copy.deepcopy(change["n"])
+    else:
+        parent.pop(last, None)
+    return state
+
+
+def apply_changes(state, changes):
+    """Apply change records; ordering records go last."""
+    ordered = [c for c in changes if not c["p"] or c["p"][-1] != ORDER]
+    ordered += [c for c in changes if c["p"] and c["p"][-1] == ORDER]
+    for change in ordered:
+        state = _apply_one(state, change)
+    return state
+
+
+def invert(changes):
+    inverse = []
+    for c in changes:
+        inv = {"p": c["p"]}
+        if "n" in c:
+            inv["o"] = c["n"]
+        if "o" in c:
+            inv["n"] = c["o"]
+        inverse.append(inv)
+    return inverse
+
+
+# ─── Public API ─────────────────────────────────────────────────
+
+def _state(path):
+    """Current (cached) state and last revision number of a data file."""
+    stamp = _stamp(path)
+    with _cache_lock:
+        cached = _cache_get(path)
+        if cached and cached[0] == stamp:
+            return cached[1], cached[2]
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    last_rev = _last_rev(_history_path(path))
+    for record in _read_records(_journal_path(path)):
+        state = apply_changes(state, record["changes"])
+        last_rev = record["rev"]
+    with _cache_lock:
+        _cache_put(path, (stamp, state, last_rev))
+    return state, last_rev
+
+
+def version(path):
+    """Cheap token that changes whenever the state of a data file may have; None if it is missing."""
+    try:
+        return _stamp(path)
+    except FileNotFoundError:
+        return None
+
+
+def load(path):
+    """Return a private copy of the current state of a data file."""
+    state, _ = _state(path)
+    return copy.deepcopy(state)
+
+
+def view(path):
+    """Return the shared cached state; callers must not modify it."""
+    state, _ = _state(path)
+    return state
+
+
+def save(path, data, note=None):
+    """Journal the difference between the stored state and ``data``.
+
+    Returns the new revision number, or None if nothing changed.
+    """
+    if not os.path.exists(path):
+        write_snapshot(path, data)
+        return None
+    with locked(path):
+        current, last_rev = _state(path)
+        changes = diff(current, data)
+        if not changes:
+            return None
+        rev = last_rev + 1
+        record = {"rev": rev, "ts": datetime.now().isoformat(timespec="seconds"), "changes": changes}
+        if note:
+            record["note"] = note
+        _append(_journal_path(path), record)
+        with _cache_lock:
+            _cache_put(path, (_stamp(path), copy.deepcopy(data), rev))
+    if _needs_compaction(path):
+        threading.Thread(target=compact, args=(path,), daemon=True).start()
+    return rev
+
+
+def _needs_compaction(path):
+    try:
+        size = os.path.getsize(_journal_path(path))
+    except OSError:
+        return False
+    if size >= COMPACT_AFTER_BYTES:
+        return True
+    with open(_journal_path(path), "rb") as f:
+        return sum(1 for _ in f) >= COMPACT_AFTER_RECORDS
+
+
+def compact(path):
+    """Fold the journal into the snapshot and archive its records."""
+    with locked(path):
+        records = _read_records(_journal_path(path))
+        if not records:
+            return
+        state, _ = _state(path)
+        write_snapshot(path, state)
+        history = _read_records(_history_path(path)) + records
+        history = history[-HISTORY_LIMIT:]
+        tmp = _history_path(path) + f".tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in history:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp, _history_path(path))
+        os.remove(_journal_path(path))
+        with _cache_lock:
+            _cache_drop(path)
+
+
+def snapshot(path, dest):
+    """Copy the current state of a data file to ``dest``, cheaply.
+
+    Snapshots are only ever replaced, never written in place, so a hardlink
+    keeps this moment's version. The journal grows in place and is copied.
+    """
+    with locked(path):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.exists(path):
+            try:
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+        if os.path.exists(_journal_path(path)):
+            shutil.copyfile(_journal_path(path), _journal_path(dest))
+
+
+def _matches(change, prefix):
+    return change["p"][:len(prefix)] == prefix
+
+
+def revisions(path, prefix=()):
+    """Revisions touching ``prefix`` (a path such as ["contact_page"]), newest first."""
+    prefix = list(prefix)
+    records = _read_records(_history_path(path)) + _read_records(_journal_path(path))
+    result = []
+    for record in reversed(records):
+        changes = [c for c in record["changes"] if _matches(c, prefix)]
+        if changes:
+            result.append({"rev": record["rev"], "ts": record["ts"], "changes": changes,
+                           "note": record.get("note")})
+    return result
+
+
+class RevertConflict(Exception):
+    """A later revision changed the same values; reverting would overwrite it."""
+
+    def __init__(self, paths):
+        super().__init__(", ".join(paths))
+        self.paths = paths
+
+
+class RevertMissingFiles(RevertConflict):
+    """The reverted state would point at files (uploads, bodies) that were deleted since."""
+
+
+_MISSING = object()
+
+
+def _lookup(state, path):
+    """Value at ``path``, or ``_MISSING``; ``#order`` yields the slug order."""
+    node = state
+    for seg in path:
+        if seg == ORDER:
+            return [i.get("slug") for i in node] if isinstance(node, list) else _MISSING
+        if isinstance(node, dict) and not isinstance(seg, dict):
+            node = node.get(seg, _MISSING)
+        elif isinstance(node, list):
+            node = _child(node, seg)
+            node = _MISSING if node is None else node
+        else:
+            return _MISSING
+        if node is _MISSING:
+            return _MISSING
+    return node
+
+
+def _path_label(path):
+    return "/".join(str(seg["slug"]) if isinstance(seg, dict) else str(seg) for seg in path)
+
+
+def revert(path, rev, prefix=(), missing_files=None):
+    """Undo the changes of revision ``rev`` (limited to ``prefix``) as a new revision.
+
+    Raises ``RevertConflict`` if a later revision changed any of the same
+    values: the revert would silently overwrite that newer edit.
+    ``missing_files(state)`` lists files a state refers to that do not exist;
+    if the revert would bring back such references, ``RevertMissingFiles``
+    is raised instead of saving a state that points at nothing.
+    """
+    prefix = list(prefix)
+    records = _read_records(_history_path(path)) + _read_records(_journal_path(path))
+    record = next((r for r in records if r["rev"] == rev), None)
+    if record is None:
+        return None
+    changes = [c for c in record["changes"] if _matches(c, prefix)]
+    current = load(path)
+    conflicts = [_path_label(c["p"]) for c in changes
+                 if _lookup(current, c["p"]) != c.get("n", _MISSING)]
+    if conflicts:
+        raise RevertConflict(conflicts)
+    already_missing = set(missing_files(current)) if missing_files else set()
+    state = apply_changes(current, list(reversed(invert(changes))))
+    if missing_files:
+        missing = sorted(set(missing_files(state)) - already_missing)
+        if missing:
+            raise RevertMissingFiles(missing)
+    return save(path, state, note=f"Откат ревизии {rev}")
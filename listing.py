@@ -0,0 +1,73 @@
+"""
+Indexes behind the admin lists: paging, sorting and filtering.
+
+An index is built from the shared cached state of a data file
+(``journal.view``). The items are not copied. It stores the item positions
+pre-sorted by every sort key, the items grouped by status, and a lower-case
+"title slug" string for the text filter. A page request then only walks
+positions and slices. The journal replaces the cached state object on every
+write, so an index is rebuilt when the state it was built from is no longer
+current. It is also rebuilt when a scheduled publication changes a status
+(``valid_until``).
+"""
+import math
+import threading
+from collections import namedtuple
+
+PER_PAGE = 25
+STATUS_ORDER = {"published": 0, "scheduled": 1, "draft": 2, "expired": 3}
+
+Row = namedtuple("Row", "position item status")   # position: 1-based place in the data file
+Page = namedtuple("Page", "rows total page pages")
+
+_indexes = {}   # path -> (state, Index)
+_lock = threading.Lock()
+
+
+class Index:
+    def __init__(self, items, status_of, sort_keys, valid_until=None):
+        """``sort_keys`` maps sort names to key functions of an item."""
+        self.items = items
+        self.statuses = [status_of(item) for item in items]
+        self.text = [f"{item.get('title', '')} {item.get('slug', '')}".casefold() for item in items]
+        positions = range(len(items))
+        self.orders = {"position": list(positions),
+                       "status": sorted(positions, key=lambda i: STATUS_ORDER.get(self.statuses[i], 9))}
+        for name, key in sort_keys.items():
+            self.orders[name] = sorted(positions, key=lambda i: key(items[i]))
+        self.by_status = {}
+        for i, status in enumerate(self.statuses):
+            self.by_status.setdefault(status, set()).add(i)
+        self.valid_until = valid_until
+
+    def counts(self):
+        """Number of items with each status, plus ``total``."""
+        counts = {status: len(found) for status, found in self.by_status.items()}
+        counts["total"] = len(self.items)
+        return counts
+
+    def query(self, q="", status="", sort="position", desc=False, page=1, per_page=PER_PAGE):
+        order = self.orders.get(sort, self.orders["position"])
+        if desc:
+            order = reversed(order)
+        q = q.strip().casefold()
+        wanted = self.by_status.get(status, set()) if status else None
+        matches = [i for i in order
+                   if (wanted is None or i in wanted) and (not q or q in self.text[i])]
+        pages = max(1, math.ceil(len(matches) / per_page))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * per_page
+        rows = [Row(i + 1, self.items[i], self.statuses[i]) for i in matches[start:start + per_page]]
+        return Page(rows, len(matches), page, pages)
+
+
+def index_for(path, state, build, now):
+    """Cached index of ``state`` (the current view of ``path``); ``build(state)`` makes a new one."""
+    with _lock:
+        cached = _indexes.get(path)
+    if cached and cached[0] is state and (cached[1].valid_until is None or now < cached[1].valid_until):
+        return cached[1]
+    index = build(state)
+    with _lock:
+        _indexes[path] = (state, index)
+    return index
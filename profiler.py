@@ -0,0 +1,384 @@
+"""
+On-demand request profiler for the live app.
+
+The admin arms the profiler for the next N requests, optionally only for one
+endpoint and only for requests slower than a threshold. Each site has its own
+profiles directory; the settings are kept in ``<dir>/config.json`` so every
+worker process sees them. While the profiler is
+disarmed the middleware only compares a clock value per request and re-checks
+the file at most once per ``CHECK_INTERVAL`` seconds.
+
+An armed request is stack-sampled from a background thread. Each saved profile
+is a pair of files:
+
+- ``<name>.folded``: collapsed stacks (``frame;frame;frame count``) for
+  flamegraph.pl, speedscope or inferno. Jinja frames are labelled
+  ``page.html:block content``.
+- ``<name>.json``: request metadata, the measured render time of every template
+  and the block times estimated from the samples.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+
+from flask.signals import before_render_template, template_rendered
+from werkzeug.exceptions import HTTPException
+
+import journal
+
+CHECK_INTERVAL = 1.0          # seconds between config checks
+DEFAULT_INTERVAL_MS = 2       # sampling interval
+PROFILE_LIMIT = 100           # newest profiles kept on disk
+SKIP_PREFIXES = ("/static/", "/admin/profiler")
+CONFIG_NAME = "config.json"
+
+_local = threading.local()
+_root = os.path.dirname(os.path.abspath(__file__))
+
+
+# ─── Settings ──────────────────────────────────────────────────
+
+def config_path(directory):
+    return os.path.join(directory, CONFIG_NAME)
+
+
+def get_config(directory):
+    """Current settings, or None while disarmed."""
+    try:
+        with open(config_path(directory), "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return config if config.get("remaining", 0) > 0 else None
+
+
+def arm(directory, count, endpoint="", threshold_ms=0, interval_ms=DEFAULT_INTERVAL_MS):
+    """Profile the next ``count`` requests (to ``endpoint``, slower than ``threshold_ms``)."""
+    os.makedirs(directory, exist_ok=True)
+    journal.write_snapshot(config_path(directory), {
+        "endpoint": endpoint,
+        "remaining": count,
+        "threshold_ms": threshold_ms,
+        "interval_ms": interval_ms,
+        "armed_at": datetime.now().isoformat(timespec="seconds"),
+    })
+
+
+def disarm(directory):
+    try:
+        os.remove(config_path(directory))
+    except FileNotFoundError:
+        pass
+
+
+def _claim_slot(directory):
+    """Take one of the remaining profile slots; False if another worker took the last one."""
+    path = config_path(directory)
+    if not os.path.exists(path):
+        return False
+    with journal.locked(path):
+        config = get_config(directory)
+        if config is None:
+            return False
+        config["remaining"] -= 1
+        if config["remaining"] > 0:
+            journal.write_snapshot(path, config)
+        else:
+            disarm(directory)
+    return True
+
+
+# ─── Stored profiles ───────────────────────────────────────────
+
+def list_profiles(directory):
+    """Metadata of saved profiles, newest first."""
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.endswith(".json") and n != CONFIG_NAME),
+                       reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_files(directory, name):
+    """(metadata, folded) paths of one profile, or None for unknown names."""
+    if not re.fullmatch(r"[\w-]+", name or ""):
+        return None
+    meta, folded = os.path.join(directory, name + ".json"), os.path.join(directory, name + ".folded")
+    return (meta, folded) if os.path.isfile(meta) and os.path.isfile(folded) else None
+
+
+def hottest(folded_path, limit=15):
+    """Functions with the most samples at the top of the stack: [(label, samples)]."""
+    leaves = Counter()
+    with open(folded_path, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            leaves[stack.rsplit(";", 1)[-1]] += int(count)
+    return leaves.most_common(limit)
+
+
+def clear(directory):
+    for meta in list_profiles(directory):
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(directory, meta["name"] + ext))
+            except FileNotFoundError:
+                pass
+
+
+def _prune(directory):
+    for meta in list_profiles(directory)[PROFILE_LIMIT:]:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(directory, meta["name"] + ext))
+            except FileNotFoundError:
+                pass
+
+
+# ─── Sampling ──────────────────────────────────────────────────
+
+@lru_cache(maxsize=4096)
+def _label(code):
+    path = code.co_filename
+    if path.endswith((".html", ".xml", ".js", ".txt")) and "templates" in path:
+        template = path.split("templates" + os.sep, 1)[-1]
+        if code.co_name.startswith("block_"):
+            return f"{template}:block {code.co_name[6:]}"
+        return template if code.co_name == "root" else f"{template}:{code.co_name}"
+    if "site-packages" + os.sep in path:
+        short = path.split("site-packages" + os.sep, 1)[1]
+    elif path.startswith(_root):
+        short = os.path.relpath(path, _root)
+    else:
+        short = os.path.basename(path)
+    return f"{code.co_name} ({short})"
+
+
+def _stack(frame, stop):
+    labels = []
+    while frame is not None and frame.f_code is not stop:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _Sampler:
+    """One background thread sampling the stacks of all profiled request threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.targets = {}   # thread id -> Counter of collapsed stacks
+        self.interval = DEFAULT_INTERVAL_MS / 1000
+        self.thread = None
+
+    def start(self, tid, interval):
+        with self.lock:
+            self.targets[tid] = Counter()
+            self.interval = interval
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def stop(self, tid):
+        with self.lock:
+            return self.targets.pop(tid, Counter())
+
+    def _run(self):
+        stop = Profiler._profile.__code__
+        while True:
+            with self.lock:
+                if not self.targets:
+                    self.thread = None
+                    return
+                targets = list(self.targets.items())
+                interval = self.interval
+            frames = sys._current_frames()
+            for tid, counter in targets:
+                frame = frames.get(tid)
+                if frame is not None:
+                    stack = _stack(frame, stop)
+                    if stack:
+                        counter[stack] += 1
+            del frames
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+
+
+# ─── Template timing (connected only while armed) ──────────────
+
+def _template_started(sender, template, context, **extra):
+    record = getattr(_local, "record", None)
+    if record is not None:
+        record["_starts"].append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    record = getattr(_local, "record", None)
+    if record is not None and record["_starts"]:
+        ms = (time.perf_counter() - record["_starts"].pop()) * 1000
+        record["templates"].append({"name": template.name, "ms": round(ms, 2)})
+
+
+def _block_times(samples, interval_ms):
+    """Estimated time per template and block: samples whose stack passes through it."""
+    totals = Counter()
+    for stack, count in samples.items():
+        for label in {f for f in stack.split(";") if ".html" in f and " (" not in f}:
+            totals[label] += count
+    return [{"name": name, "ms": round(count * interval_ms, 2)} for name, count in totals.most_common()]
+
+
+# ─── Middleware ────────────────────────────────────────────────
+
+class _ProfiledBody:
+    """Response body that calls ``finish`` once, when the server closes it."""
+
+    def __init__(self, body, finish):
+        self.body = body
+        self.finish = finish
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            finish, self.finish = self.finish, None
+            if finish:
+                finish()
+
+
+class _Watch:
+    """Settings of one profiles directory, re-read at most once per ``CHECK_INTERVAL``."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.config = None
+        self.stamp = None
+        self.next_check = 0.0
+
+
+class Profiler:
+    """WSGI middleware; costs one clock comparison per request while disarmed."""
+
+    def __init__(self, wsgi_app, flask_app, directory_for):
+        """``directory_for(environ)`` gives the profiles directory of the request's site, or None."""
+        self.app = wsgi_app
+        self.flask_app = flask_app
+        self.directory_for = directory_for
+        self.watches = {}  # directory -> _Watch
+
+    def __call__(self, environ, start_response):
+        directory = self.directory_for(environ)
+        if directory is None:
+            return self.app(environ, start_response)
+        watch = self.watches.get(directory) or self.watches.setdefault(directory, _Watch(directory))
+        now = time.monotonic()
+        if now >= watch.next_check:
+            self._refresh(watch, now)
+        if watch.config is None or environ.get("PATH_INFO", "").startswith(SKIP_PREFIXES):
+            return self.app(environ, start_response)
+        return self._profile(watch, environ, start_response)
+
+    def _refresh(self, watch, now):
+        watch.next_check = now + CHECK_INTERVAL
+        try:
+            st = os.stat(config_path(watch.directory))
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if stamp == watch.stamp:
+            return
+        watch.stamp = stamp
+        watch.config = get_config(watch.directory) if stamp else None
+        # Template timing is needed while any site is armed
+        if any(w.config for w in list(self.watches.values())):
+            before_render_template.connect(_template_started)
+            template_rendered.connect(_template_finished)
+        else:
+            before_render_template.disconnect(_template_started)
+            template_rendered.disconnect(_template_finished)
+
+    def _endpoint(self, environ):
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return ""
+        return endpoint
+
+    def _profile(self, watch, environ, start_response):
+        config = watch.config
+        endpoint = self._endpoint(environ)
+        if config["endpoint"] and endpoint != config["endpoint"]:
+            return self.app(environ, start_response)
+
+        status = []
+
+        def _start_response(code, headers, exc_info=None):
+            status.append(int(code.split()[0]))
+            return start_response(code, headers, exc_info)
+
+        record = {"templates": [], "_starts": []}
+        interval_ms = config.get("interval_ms") or DEFAULT_INTERVAL_MS
+        tid = threading.get_ident()
+        _local.record = record
+        _sampler.start(tid, interval_ms / 1000)
+        started = time.perf_counter()
+
+        def finish():
+            duration_ms = (time.perf_counter() - started) * 1000
+            samples = _sampler.stop(tid)
+            _local.record = None
+            if duration_ms >= (config.get("threshold_ms") or 0) and _claim_slot(watch.directory):
+                self._save(watch.directory, environ, endpoint, status, duration_ms, interval_ms, record, samples)
+
+        try:
+            body = self.app(environ, _start_response)
+        except BaseException:
+            finish()
+            raise
+        # The body is passed through, not collected, so streamed responses keep
+        # streaming; the measurement ends when the server closes it
+        return _ProfiledBody(body, finish)
+
+    def _save(self, directory, environ, endpoint, status, duration_ms, interval_ms, record, samples):
+        now = datetime.now()
+        name = f"{now:%Y%m%d-%H%M%S}-{now.microsecond:06d}-{endpoint or 'unknown'}"
+        root = f"{environ.get('REQUEST_METHOD', 'GET')} {endpoint or environ.get('PATH_INFO', '')}"
+        with open(os.path.join(directory, name + ".folded"), "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{root};{stack} {count}\n")
+        meta = {
+            "name": name,
+            "ts": now.isoformat(timespec="seconds"),
+            "method": environ.get("REQUEST_METHOD", "GET"),
+            "path": environ.get("PATH_INFO", ""),
+            "query": environ.get("QUERY_STRING", ""),
+            "endpoint": endpoint,
+            "status": status[0] if status else None,
+            "duration_ms": round(duration_ms, 2),
+            "interval_ms": interval_ms,
+            "samples": sum(samples.values()),
+            "templates": record["templates"],
+            "blocks": _block_times(samples, interval_ms),
+        }
+        journal.write_snapshot(os.path.join(directory, name + ".json"), meta)
+        _prune(directory)
@@ -0,0 +1,60 @@
+"""
+Build-time service worker for the frozen site.
+
+After freezing we hash the core assets and the main pages and write
+``build/precache-manifest.json``::
+
+    {"version": "3f2a9c1b0d", "precache": [
+        {"url": "static/css/style.css", "revision": "a1b2c3d4e5"}, ...]}
+
+URLs are relative to the site root, so the site also works from a
+subdirectory. The same manifest is embedded in ``build/sw.js``. The worker
+keys every cached entry by URL and revision. Only changed files are
+downloaded again, and entries that are no longer listed are evicted.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = "precache-manifest.json"
+SW_NAME = "sw.js"
+
+CORE_ASSETS = ("static/css/style.css", "static/js/main.js", "static/images/favicon.svg")
+HASH_LENGTH = 10
+
+
+def file_revision(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def _build_path(build_dir, url):
+    """File behind a root-relative URL (``about/`` -> about/index.html)."""
+    path = url.lstrip("/")
+    if not path or path.endswith("/"):
+        path += "index.html"
+    return os.path.join(build_dir, path)
+
+
+def build_manifest(build_dir, page_urls, assets=CORE_ASSETS):
+    """Precache entries for the given pages and assets that exist in the build."""
+    entries = []
+    for url in list(assets) + list(page_urls):
+        path = _build_path(build_dir, url)
+        if os.path.isfile(path):
+            entries.append({"url": url.lstrip("/") or "./", "revision": file_revision(path)})
+    version = hashlib.sha256(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()[:HASH_LENGTH]
+    return {"version": version, "precache": entries}
+
+
+def write_service_worker(build_dir, template, page_urls):
+    """Write the manifest and the rendered worker into ``build_dir``; returns the manifest."""
+    manifest = build_manifest(build_dir, page_urls)
+    with open(os.path.join(build_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(build_dir, SW_NAME), "w", encoding="utf-8") as f:
+        f.write(template.render(manifest=manifest))
+    return manifest
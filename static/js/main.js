@@ -1,6 +1,6 @@
 /**
  * Миронова — Психолог
- * Main JavaScript: theme toggle, mobile menu, scroll effects, animations
+ * Main JavaScript: theme toggle, mobile menu, scroll effects, animations, service worker
  */
 
 (function () {
@@ -469,4 +469,13 @@
         });
     }
 
+    // ===== Service Worker (static build only) =====
+    // sw.js lives in the site root, two levels above static/js/main.js
+    const mainScript = document.currentScript;
+    if ('serviceWorker' in navigator && mainScript && mainScript.hasAttribute('data-sw')) {
+        window.addEventListener('load', () => {
+            navigator.serviceWorker.register(new URL('../../sw.js', mainScript.src)).catch(() => {});
+        });
+    }
+
 })();
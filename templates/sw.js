@@ -0,0 +1,142 @@
+/**
+ * Миронова — Психолог
+ * Service worker, generated by freeze.py from templates/sw.js — do not edit build/sw.js
+ *
+ * - core assets and main pages: precached, keyed by revision from the manifest
+ * - pages (incl. articles): stale-while-revalidate, cache dropped on new version
+ * - uploads: cache-first (upload names are unique)
+ * - fonts / icon CDN: stale-while-revalidate
+ */
+
+'use strict';
+
+const MANIFEST = {{ manifest|tojson }};
+const VERSION = MANIFEST.version;
+
+const PRECACHE = 'precache';
+const PAGES = 'pages-' + VERSION;
+const RUNTIME = 'runtime';
+const PAGES_LIMIT = 50;
+const RUNTIME_LIMIT = 100;
+const CDN_HOSTS = ['fonts.googleapis.com', 'fonts.gstatic.com', 'cdnjs.cloudflare.com'];
+
+const ROOT = new URL('./', self.location).href;
+const UPLOADS = new URL('static/uploads/', ROOT).href;
+
+// Absolute URL -> cache key carrying the revision
+const precached = new Map(MANIFEST.precache.map(entry => {
+    const url = new URL(entry.url, ROOT).href;
+    return [url, url + '?__rev=' + entry.revision];
+}));
+
+
+// ===== Install: fetch only entries whose revision changed =====
+self.addEventListener('install', (event) => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(PRECACHE);
+        await Promise.all([...precached].map(async ([url, key]) => {
+            if (await cache.match(key)) return;
+            const response = await fetch(url, { cache: 'reload' });
+            if (response.ok) await cache.put(key, response);
+        }));
+        await self.skipWaiting();
+    })());
+});
+
+
+// ===== Activate: evict old revisions and old page caches =====
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        const wanted = new Set(precached.values());
+        const cache = await caches.open(PRECACHE);
+        for (const request of await cache.keys()) {
+            if (!wanted.has(request.url)) await cache.delete(request);
+        }
+        for (const name of await caches.keys()) {
+            if (![PRECACHE, PAGES, RUNTIME].includes(name)) await caches.delete(name);
+        }
+        await self.clients.claim();
+    })());
+});
+
+
+// ===== Strategies =====
+async function trim(cache, limit) {
+    const keys = await cache.keys();
+    for (let i = 0; i < keys.length - limit; i++) {
+        await cache.delete(keys[i]);
+    }
+}
+
+function store(cacheName, limit, request, response) {
+    if (!response.ok && response.type !== 'opaque') return Promise.resolve();
+    return caches.open(cacheName).then(async cache => {
+        await cache.put(request, response);
+        await trim(cache, limit);
+    });
+}
+
+async function staleWhileRevalidate(event, cacheName, limit, fallback) {
+    const cache = await caches.open(cacheName);
+    const cached = (await cache.match(event.request)) || (fallback && await fallback());
+    const network = fetch(event.request).then(response => {
+        event.waitUntil(store(cacheName, limit, event.request, response.clone()));
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(network.catch(() => {}));
+        return cached;
+    }
+    return network;
+}
+
+async function cacheFirst(event, cacheName, limit) {
+    const cached = await caches.match(event.request);
+    if (cached) return cached;
+    const response = await fetch(event.request);
+    event.waitUntil(store(cacheName, limit, event.request, response.clone()));
+    return response;
+}
+
+function precachedPage(url) {
+    const key = precached.get(url.split('#')[0].split('?')[0]);
+    return () => key ? caches.match(key) : undefined;
+}
+
+async function servePage(event) {
+    try {
+        return await staleWhileRevalidate(event, PAGES, PAGES_LIMIT, precachedPage(event.request.url));
+    } catch (err) {
+        // Offline and never visited: show the home page
+        const home = await caches.match(precached.get(ROOT));
+        if (home) return home;
+        throw err;
+    }
+}
+
+
+// ===== Routing =====
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+
+    if (url.origin !== self.location.origin) {
+        if (CDN_HOSTS.includes(url.hostname)) {
+            event.respondWith(staleWhileRevalidate(event, RUNTIME, RUNTIME_LIMIT));
+        }
+        return;
+    }
+    if (!url.href.startsWith(ROOT)) return;
+
+    if (request.mode === 'navigate') {
+        event.respondWith(servePage(event));
+        return;
+    }
+    const key = precached.get(url.origin + url.pathname);
+    if (key) {
+        event.respondWith(caches.match(key).then(cached => cached || fetch(request)));
+    } else if (url.href.startsWith(UPLOADS)) {
+        event.respondWith(cacheFirst(event, RUNTIME, RUNTIME_LIMIT));
+    }
+});
@@ -0,0 +1,142 @@
+"""
+Tenants: several practitioners' sites served by one app, chosen by Host header.
+
+Without ``TENANTS_FILE`` there is a single tenant living in the app's own
+directory, exactly as before. With it, the file lists the sites::
+
+    {
+        "mironova": {
+            "hosts": ["mironovayu.ru", "www.mironovayu.ru"],
+            "root": "/srv/sites/mironova",
+            "admin_password_env": "MIRONOVA_ADMIN_PASSWORD",
+            "git_remote": "origin",
+            "git_branch": "main",
+            "pages_branch": "gh-pages",
+            "upload_store": "/srv/objects/mironova"
+        }
+    }
+
+``root`` is a clone of the practitioner's site repository. Its ``data/`` and
+``static/uploads/`` are served and edited, ``build/`` points to the frozen
+site, and deploys commit and push from there. Uploads are kept in the object
+store (see upload_store.py), ``data/objects/`` unless ``upload_store`` says
+otherwise; the built site is pushed to ``pages_branch``. Templates, CSS and
+JS come from the app.
+"""
+import contextvars
+import copy
+import json
+import os
+from contextlib import contextmanager
+
+import journal
+
+CACHE_LIMIT = 64        # cached data files per tenant
+BODY_CACHE_LIMIT = 16   # cached article bodies per tenant, kept apart from the other data
+
+
+class Tenant:
+    def __init__(self, key, root, hosts=(), admin_password="admin",
+                 git_remote="origin", git_branch="main", pages_branch="gh-pages", upload_store=None):
+        self.key = key
+        self.root = os.path.abspath(root)
+        self.hosts = {h.lower() for h in hosts}
+        self.admin_password = admin_password
+        self.git_remote = git_remote
+        self.git_branch = git_branch
+        self.pages_branch = pages_branch
+
+        self.data_dir = os.path.join(self.root, "data")
+        self.content_file = os.path.join(self.data_dir, "content.json")  # legacy single-file content
+        self.content_dir = os.path.join(self.data_dir, "content")
+        self.articles_file = os.path.join(self.data_dir, "articles.json")  # index, without bodies
+        self.articles_dir = os.path.join(self.data_dir, "articles")  # one body file per article
+        self.announcements_file = os.path.join(self.data_dir, "announcements.json")
+        self.images_file = os.path.join(self.data_dir, "images.json")  # derived: sizes and placeholders
+        self.static_dir = os.path.join(self.root, "static")
+        self.upload_folder = os.path.join(self.static_dir, "uploads")
+        self.uploads_file = os.path.join(self.data_dir, "uploads.json")  # manifest of stored uploads
+        self.store_dir = os.path.abspath(upload_store or os.path.join(self.data_dir, "objects"))
+        self.build_dir = os.path.join(self.root, "build")  # symlink to the current build
+        self.builds_dir = os.path.join(self.root, "builds")  # the last few builds (see builds.py)
+        self.snapshots_dir = os.path.join(self.data_dir, ".snapshots")  # data frozen by running builds
+        self.edits_lock = os.path.join(self.data_dir, ".edits")  # held shared by edits, exclusive by snapshots
+        self.profiles_dir = os.path.join(self.data_dir, "profiles")  # on-demand request profiles, not deployed
+
+        self.deploy = None  # DeployQueue, attached by the app
+        journal.set_cache_limit(self.data_dir, CACHE_LIMIT)
+        journal.set_cache_limit(self.articles_dir, BODY_CACHE_LIMIT)
+
+    def at(self, root):
+        """The same site reading its data files from a snapshot under ``root``."""
+        view = copy.copy(self)
+        for name in ("data_dir", "content_file", "content_dir", "articles_file", "articles_dir",
+                     "announcements_file", "images_file", "uploads_file"):
+            setattr(view, name, os.path.join(root, os.path.relpath(getattr(self, name), self.root)))
+        return view
+
+    def __repr__(self):
+        return f"<Tenant {self.key}>"
+
+
+_tenants = {}   # key -> Tenant
+_hosts = {}     # host -> Tenant
+_active = contextvars.ContextVar("tenant", default=None)
+
+
+def load(default_root, config_path=None, default_password="admin"):
+    """Register the tenants from ``config_path``, or one default tenant."""
+    _tenants.clear()
+    _hosts.clear()
+    if not config_path:
+        _register(Tenant("default", default_root, admin_password=default_password,
+                         pages_branch=os.environ.get("PAGES_BRANCH", "gh-pages"),
+                         upload_store=os.environ.get("UPLOAD_STORE")))
+        return
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    for key, cfg in config.items():
+        password = os.environ.get(cfg.get("admin_password_env", ""), cfg.get("admin_password"))
+        if not password:
+            raise ValueError(f"Tenant {key}: no admin password configured")
+        _register(Tenant(key, cfg["root"], cfg.get("hosts", []), password,
+                         cfg.get("git_remote", "origin"), cfg.get("git_branch", "main"),
+                         cfg.get("pages_branch", "gh-pages"), cfg.get("upload_store")))
+
+
+def _register(tenant):
+    _tenants[tenant.key] = tenant
+    for host in tenant.hosts:
+        _hosts[host] = tenant
+
+
+def all_tenants():
+    return list(_tenants.values())
+
+
+def get(key):
+    return _tenants.get(key)
+
+
+def single():
+    """The only tenant when the app serves one site, else None."""
+    return next(iter(_tenants.values())) if len(_tenants) == 1 else None
+
+
+def for_host(host):
+    """Tenant serving ``host`` (port ignored); the single tenant serves any host."""
+    return _hosts.get(host.split(":", 1)[0].lower()) or single()
+
+
+def active():
+    return _active.get()
+
+
+@contextmanager
+def activate(tenant):
+    """Make ``tenant`` current for code running outside a request (threads, CLI)."""
+    token = _active.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _active.reset(token)
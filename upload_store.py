@@ -0,0 +1,104 @@
+"""
+Content-addressed store of uploaded files, kept out of git.
+
+Uploads are still written to ``static/uploads/`` and served from there, but
+that directory is no longer committed. Every referenced upload is also kept
+as ``<store>/<sha[:2]>/<sha256>``. Objects are written once and never
+changed; they are hardlinked when possible. The repository tracks only the
+manifest ``data/uploads.json``::
+
+    {"uploads/articles/1.jpg": {"sha256": "...", "size": 123456}}
+
+The freezer materializes the manifest into ``build/static/`` from the store,
+so a deploy pushes the data files and the changed pages, not the images.
+``restore`` recreates ``static/uploads/`` from the store, for example on a
+fresh clone.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import journal
+from backup import file_sha256
+
+
+def object_path(store, sha):
+    return os.path.join(store, sha[:2], sha)
+
+
+def _place(source, target):
+    """Hardlink ``source`` to ``target``, or copy it if linking is not possible."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(target))
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)  # other volume, or no hardlink support
+    os.replace(tmp, target)
+
+
+def add(store, path):
+    """Put the file at ``path`` into the store; returns its manifest entry."""
+    sha = file_sha256(path)
+    target = object_path(store, sha)
+    if not os.path.exists(target):
+        _place(path, target)
+    return {"sha256": sha, "size": os.path.getsize(path)}
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def sync(store, static_dir, manifest_path, rel_paths):
+    """Store every referenced upload and rewrite the manifest to exactly ``rel_paths``.
+
+    A file missing from ``static_dir`` keeps its previous entry if the store
+    still has the object. Returns ``(manifest, missing)``.
+    """
+    with journal.locked(manifest_path):
+        previous = load_manifest(manifest_path) or {}
+        manifest, missing = {}, []
+        for rel in sorted(set(rel_paths)):
+            path = os.path.join(static_dir, rel)
+            if os.path.isfile(path):
+                manifest[rel] = add(store, path)
+            elif rel in previous and os.path.exists(object_path(store, previous[rel]["sha256"])):
+                manifest[rel] = previous[rel]
+            else:
+                missing.append(rel)
+        if manifest != previous:
+            journal.write_snapshot(manifest_path, manifest)
+    return manifest, missing
+
+
+def materialize(store, manifest, dest_dir, fallback_dir=None):
+    """Place every manifest entry under ``dest_dir``; returns the paths that could not be found.
+
+    Files already in place with the right size are left alone. Entries
+    missing from the store are taken from ``fallback_dir`` when present.
+    """
+    missing = []
+    for rel, entry in manifest.items():
+        target = os.path.join(dest_dir, rel)
+        if os.path.isfile(target) and os.path.getsize(target) == entry["size"]:
+            continue
+        source = object_path(store, entry["sha256"])
+        if not os.path.exists(source) and fallback_dir:
+            source = os.path.join(fallback_dir, rel)
+        if os.path.exists(source):
+            _place(source, target)
+        else:
+            missing.append(rel)
+    return missing
+
+
+def restore(store, manifest, static_dir):
+    """Recreate missing files in ``static_dir`` from the store."""
+    return materialize(store, manifest, static_dir)